@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import json
+import cProfile
 from plumbum import cli, local
 from searcher.controll import get_controller, load_config
 
@@ -14,10 +16,30 @@ def ExistingPath(val):
 class PythonSearcher(cli.Application):
     """Python fulltext search engine CLI"""
     VERSION = '0.1'
+    profiler = None
+
+    profile = cli.SwitchAttr('--profile', str,
+                             help='Dump cProfile stats of executed command '
+                             'to this file (readable by pstats, snakeviz '
+                             'or flameprof)')
+    stats = cli.SwitchAttr('--stats', str,
+                           help='Write timers and counters collected while '
+                           'executing command to this file as JSON')
 
     def main(self):
         config = load_config('searcher.ini')
         self.controller = get_controller(config)
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def cleanup(self, retcode):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+        if self.stats:
+            with open(self.stats, 'w') as fp:
+                json.dump(self.controller.stats.as_dict(), fp, indent=2)
 
 
 @PythonSearcher.subcommand('init')
@@ -33,23 +55,95 @@ class PythonSearcherInit(cli.Application):
         self._components = component
 
     def main(self):
-        self.root_app.controller.init(self._component, self.force)
+        self.root_app.controller.init(self._components, self.force)
 
 
 @PythonSearcher.subcommand('register')
 class PythonSearcherRegister(cli.Application):
     """Import documents into database"""
+    realtime = cli.Flag(['-i', '--index'],
+                        help='Index registered documents right away, '
+                        'without full index run')
+
     def main(self, root: ExistingPath):
-        self.root_app.controller.register(root)
+        controller = self.root_app.controller
+        controller.register(root, self.realtime)
+        if self.realtime:
+            merged = controller.merge_delta()
+            print('merged {} postings into index store'.format(merged))
 
 
 @PythonSearcher.subcommand('index')
 class PythonSearcherIndex(cli.Application):
     """Index documents in datastore. Takes long time. You've been warned"""
     use_spark = cli.Flag('--spark', help='Utilize spark to index documents')
+    resume = cli.Flag('--resume',
+                      help='Continue interrupted index run from its last '
+                      'checkpoint')
 
     def main(self):
-        self.root_app.controller.index(self.use_spark)
+        try:
+            self.root_app.controller.index(self.use_spark, self.resume)
+        except ValueError as error:
+            print(error)
+            return 1
+
+
+@PythonSearcher.subcommand('export')
+class PythonSearcherExport(cli.Application):
+    """Write documents and indexes into datastore independent archive"""
+    def main(self, path):
+        self.root_app.controller.export_archive(path)
+
+
+@PythonSearcher.subcommand('import')
+class PythonSearcherImport(cli.Application):
+    """Load documents and indexes from archive written by export"""
+    def main(self, path: ExistingPath):
+        try:
+            self.root_app.controller.import_archive(str(path))
+        except ValueError as error:
+            print(error)
+            return 1
+
+
+@PythonSearcher.subcommand('reorder')
+class PythonSearcherReorder(cli.Application):
+    """Renumber documents so similar ones get nearby ids"""
+    by = cli.SwitchAttr('--by', cli.Set('title', 'terms'), default='title',
+                        help='Group documents by title, or by shared terms')
+    archive = cli.SwitchAttr('--archive', str, default='reorder.archive',
+                             help='Archive file used to rewrite datastores, '
+                             'kept if rewriting fails')
+    sample = cli.SwitchAttr('--sample', int,
+                            help='Number of sample queries used to measure '
+                            'latency [default: prune_sample_queries]')
+
+    def main(self):
+        try:
+            self.root_app.controller.reorder(self.by, self.archive,
+                                             self.sample)
+        except ValueError as error:
+            print(error)
+            return 1
+
+
+@PythonSearcher.subcommand('prune')
+class PythonSearcherPrune(cli.Application):
+    """Prune index, keeping only best postings of every word"""
+    top_n = cli.SwitchAttr('--top-n', int,
+                           help='Keep only this many postings of every word '
+                           '[default: prune_top_n from config]')
+    threshold = cli.SwitchAttr('--threshold', float,
+                               help='Remove postings ranked below this value '
+                               '[default: prune_threshold from config]')
+    sample = cli.SwitchAttr('--sample', int,
+                            help='Number of sample queries used to measure '
+                            'recall [default: prune_sample_queries]')
+
+    def main(self):
+        self.root_app.controller.prune(self.top_n, self.threshold,
+                                       self.sample)
 
 
 @PythonSearcher.subcommand('search')
@@ -57,12 +151,42 @@ class PythonSearcherSearch(cli.Application):
     """Search database for index hits for query string"""
     preview = cli.Flag(['-p', '--preview'],
                        help='Show preview for found matches')
+    snippets = cli.Flag(['-s', '--snippets'],
+                        help='Show passage of every match containing query '
+                        'terms, with terms highlighted')
     measure = cli.Flag(['-m', '--measure'],
                        help='Print how long it took to deliver results')
-
-    def main(self, query_string):
-        opts = {'preview': self.preview, 'measure': self.measure}
-        self.root_app.controller.query(query_string, **opts)
+    batch = cli.SwitchAttr('--batch', ExistingPath,
+                           help='Run all queries from file (one per line, or '
+                           'JSON lines with "query" key when file name ends '
+                           'with .jsonl) and print results as JSON lines')
+    workers = cli.SwitchAttr('--workers', int, default=1,
+                             help='Number of processes running batch queries')
+    timeout = cli.SwitchAttr('--timeout', int,
+                             help='Return best results found within this '
+                             'many milliseconds [default: query_timeout_ms '
+                             'from config, 0 for no limit]')
+    paginate = cli.Flag('--paginate',
+                        help='Print cursor of next page after results')
+    after = cli.SwitchAttr('--after', str,
+                           help='Show page of results following this cursor')
+
+    def main(self, query_string=None):
+        controller = self.root_app.controller
+        if not self.batch and query_string is None:
+            print('Query string or --batch file is required')
+            return 1
+        opts = {'preview': self.preview, 'measure': self.measure,
+                'paginate': self.paginate, 'cursor': self.after,
+                'snippets': self.snippets, 'timeout_ms': self.timeout}
+        try:
+            if self.batch:
+                controller.query_batch(str(self.batch), self.workers)
+            else:
+                controller.query(query_string, **opts)
+        except ValueError as error:
+            print(error)
+            return 1
 
 
 @PythonSearcher.subcommand('show')
@@ -76,6 +200,28 @@ class PythonSearcherShow(cli.Application):
         self.root_app.controller.show(document_ids, self.preview)
 
 
+@PythonSearcher.subcommand('delete')
+class PythonSearcherDelete(cli.Application):
+    """Delete documents. Their indexes are removed by purge command"""
+    def main(self, document_id, *document_ids):
+        document_ids = [document_id] + list(document_ids)
+        self.root_app.controller.delete(document_ids)
+
+
+@PythonSearcher.subcommand('update')
+class PythonSearcherUpdate(cli.Application):
+    """Replace document by content of file"""
+    def main(self, document_id, path: ExistingPath):
+        self.root_app.controller.update(document_id, str(path))
+
+
+@PythonSearcher.subcommand('purge')
+class PythonSearcherPurge(cli.Application):
+    """Remove indexes of deleted documents"""
+    def main(self):
+        self.root_app.controller.purge()
+
+
 def main():
     PythonSearcher.run()
 
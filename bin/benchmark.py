@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import argparse
+import tempfile
+from searcher.controll import load_config
+from searcher.benchmark import generate_corpus, generate_queries, \
+    benchmark_config, run_benchmark
+
+
+def print_result(result):
+    register, index, query = result['register'], result['index'], \
+        result['query']
+    print('{}:'.format(result['backend']))
+    print('  register {:.1f} documents/s'.format(
+        register['documents_per_second']))
+    print('  index    {:.1f} postings/s'.format(index['postings_per_second']))
+    print('  query    p50 {:.2f} ms, p99 {:.2f} ms, {:.1f} queries/s'.format(
+        query['p50_ms'], query['p99_ms'], query['qps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark register, index '
+                                     'and query on synthetic plot corpus')
+    parser.add_argument('-b', '--backend', action='append',
+                        choices=['sqlite3', 'mongo'],
+                        help='Datastore to benchmark, can be repeated '
+                        '[default: sqlite3]')
+    parser.add_argument('-d', '--documents', type=int, default=10000,
+                        help='Number of generated documents')
+    parser.add_argument('-q', '--queries', type=int, default=1000,
+                        help='Number of generated queries')
+    parser.add_argument('--vocabulary', type=int, default=5000,
+                        help='Number of distinct words in generated corpus')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of corpus and query generator')
+    parser.add_argument('--workdir', help='Directory for corpus and sqlite '
+                        'databases, temporary directory is used by default')
+    parser.add_argument('-o', '--output', default='benchmark.jsonl',
+                        help='Results are appended to this file as JSON lines')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pyse-benchmark-')
+    corpus_root = os.path.join(workdir, 'corpus')
+    try:
+        vocabulary = generate_corpus(corpus_root, args.documents, args.seed,
+                                     args.vocabulary)
+        queries = generate_queries(vocabulary, args.queries, args.seed)
+        for backend in args.backend or ['sqlite3']:
+            config = benchmark_config(load_config(), backend, workdir)
+            result = run_benchmark(config, corpus_root, args.documents,
+                                   queries, workdir)
+            result.update(seed=args.seed, vocabulary=args.vocabulary)
+            with open(args.output, 'a') as fp:
+                fp.write(json.dumps(result, sort_keys=True) + '\n')
+            print_result(result)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
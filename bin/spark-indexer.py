@@ -4,6 +4,7 @@ from bson.objectid import ObjectId
 from pyspark import SparkContext
 from searcher.controll import load_config
 from searcher.document import GenericDocument
+from searcher.impacts import ImpactQuantizer
 
 
 def get_object_id(java_dict):
@@ -16,13 +17,17 @@ def get_object_id(java_dict):
     return ObjectId(bin_str)
 
 
-def index_document(mongo_document):
+def index_document(mongo_document, quantization=0):
     #obj_id = get_object_id(mongo_document['_id'])
     obj_id = mongo_document['_id']
-    document = GenericDocument(str(obj_id), mongo_document['content'])
+    document = GenericDocument(str(obj_id), mongo_document['content'],
+                               mongo_document.get('codec', 'none'))
     document.indexer.index_document()
+    indexes = document.indexer
+    if quantization:
+        indexes = ImpactQuantizer(quantization)(indexes)
     return [(None, {'word': i[1], 'hit': {'document': i[0], 'rank': i[2]}})
-            for i in document.indexer]
+            for i in indexes]
 
 
 def join_hits(hit1, hit2):
@@ -48,7 +53,8 @@ def index():
                                      {'mongo.input.uri': dbpath_in})
     doc_rdd = doc_rdd_raw.values()
 
-    result = doc_rdd.flatMap(index_document)#.reduceByKey(join_hits)
+    quantization = int(config.get('default', 'quantization', fallback='0'))
+    result = doc_rdd.flatMap(lambda doc: index_document(doc, quantization))
     #result.coalesce(1, True).saveAsTextFile('results')
     result.saveAsNewAPIHadoopFile(
         'file:///placeholder',
@@ -0,0 +1,156 @@
+import json
+import zlib
+import struct
+
+from searcher.utils import encode_varint, decode_varint
+
+
+MAGIC = b'PYSRCH\x00\x01'
+CHUNK = struct.Struct('>cII')
+RANK = struct.Struct('>d')
+HEADER = b'H'
+DOCUMENTS = b'D'
+POSTINGS = b'P'
+END = b'E'
+
+
+class ArchiveWriter:
+    """Writes documents and posting lists in backend independent format.
+    Records are grouped into zlib compressed chunks, each with kind, length
+    and crc32 checksum. Documents are numbered in order of writing and
+    postings refer to these numbers, so ids can be remapped on import.
+    """
+    def __init__(self, fp, impact_bits=0, chunk_size=1024 * 1024):
+        self.fp = fp
+        self.impact_bits = impact_bits
+        self.chunk_size = chunk_size
+        self.kind, self.buffer = None, bytearray()
+        self.ordinals = dict()
+        self.postings = 0
+        fp.write(MAGIC)
+        header = {'impact_bits': impact_bits}
+        self.write_chunk(HEADER, json.dumps(header).encode('utf-8'))
+
+    def write_chunk(self, kind, payload):
+        data = zlib.compress(bytes(payload))
+        self.fp.write(CHUNK.pack(kind, len(data), zlib.crc32(data)))
+        self.fp.write(data)
+
+    def append(self, kind, record):
+        if kind != self.kind:
+            self.flush()
+            self.kind = kind
+        self.buffer += record
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_chunk(self.kind, self.buffer)
+            self.buffer = bytearray()
+
+    def add_document(self, document_id, content):
+        self.ordinals[str(document_id)] = len(self.ordinals)
+        content = content.encode('utf-8')
+        self.append(DOCUMENTS, encode_varint(len(content)) + content)
+
+    def add_postings(self, word, hits):
+        """Write hits of word, skipping documents not written before.
+        Returns number of written hits.
+        """
+        hits = [(self.ordinals[str(doc_id)], rank) for doc_id, rank in hits
+                if str(doc_id) in self.ordinals]
+        if not hits:
+            return 0
+        word = word.encode('utf-8')
+        record = bytearray(encode_varint(len(word)) + word)
+        record += encode_varint(len(hits))
+        for ordinal, rank in hits:
+            record += encode_varint(ordinal)
+            if self.impact_bits:
+                record += encode_varint(rank)
+            else:
+                record += RANK.pack(rank)
+        self.append(POSTINGS, record)
+        self.postings += len(hits)
+        return len(hits)
+
+    def close(self):
+        self.flush()
+        counts = {'documents': len(self.ordinals), 'postings': self.postings}
+        self.write_chunk(END, json.dumps(counts).encode('utf-8'))
+
+
+class ArchiveReader:
+    """Reads archive written by ArchiveWriter, verifying checksums of all
+    chunks. Iterating yields (DOCUMENTS, content) and
+    (POSTINGS, (word, [(document number, rank)])) records.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError('file is not searcher archive')
+        self.chunk_number = 0
+        kind, payload = self.read_chunk()
+        if kind != HEADER:
+            raise ValueError('archive header is missing')
+        self.header = json.loads(payload.decode('utf-8'))
+        self.impact_bits = self.header['impact_bits']
+
+    def read_chunk(self):
+        self.chunk_number += 1
+        head = self.fp.read(CHUNK.size)
+        if len(head) < CHUNK.size:
+            raise ValueError('archive is truncated')
+        kind, length, checksum = CHUNK.unpack(head)
+        data = self.fp.read(length)
+        if len(data) < length:
+            raise ValueError('archive is truncated')
+        if zlib.crc32(data) != checksum:
+            raise ValueError('chunk {} of archive is corrupted'
+                             .format(self.chunk_number))
+        return kind, zlib.decompress(data)
+
+    def __iter__(self):
+        documents = postings = 0
+        while True:
+            kind, payload = self.read_chunk()
+            if kind == DOCUMENTS:
+                for content in self.decode_documents(payload):
+                    documents += 1
+                    yield DOCUMENTS, content
+            elif kind == POSTINGS:
+                for word, hits in self.decode_postings(payload):
+                    postings += len(hits)
+                    yield POSTINGS, (word, hits)
+            elif kind == END:
+                counts = json.loads(payload.decode('utf-8'))
+                if counts != {'documents': documents, 'postings': postings}:
+                    raise ValueError('archive counts do not match content')
+                return
+            else:
+                raise ValueError('unknown chunk {!r} in archive'.format(kind))
+
+    def decode_documents(self, payload):
+        position = 0
+        while position < len(payload):
+            length, position = decode_varint(payload, position)
+            yield payload[position:position + length].decode('utf-8')
+            position += length
+
+    def decode_postings(self, payload):
+        position = 0
+        while position < len(payload):
+            length, position = decode_varint(payload, position)
+            word = payload[position:position + length].decode('utf-8')
+            count, position = decode_varint(payload, position + length)
+            hits = []
+            for _ in range(count):
+                ordinal, position = decode_varint(payload, position)
+                if self.impact_bits:
+                    rank, position = decode_varint(payload, position)
+                else:
+                    rank = RANK.unpack_from(payload, position)[0]
+                    position += RANK.size
+                hits.append((ordinal, rank))
+            yield word, hits
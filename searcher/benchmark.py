@@ -0,0 +1,163 @@
+import os
+import csv
+import math
+import time
+import random
+import platform
+import subprocess
+from itertools import accumulate
+
+from searcher.controll import get_controller
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'dor', 'vam', 'pir', 'sel', 'tu',
+             'gan', 'be', 'str', 'on', 'fel', 'ix', 'ma', 'nor', 'qu']
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        syllables = rng.randint(1, 4)
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(syllables)))
+    return sorted(words)
+
+
+def zipf_cum_weights(size, exponent=1.0):
+    """Cumulative weights making few words very common and most words rare,
+    which is how words are spread over real plots.
+    """
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+def generate_plot(rng, vocabulary, cum_weights, min_words, max_words):
+    title = ' '.join(rng.choices(vocabulary, k=rng.randint(1, 4))).title()
+    year = rng.randint(1920, 2016)
+    count = rng.randint(min_words, max_words)
+    words = rng.choices(vocabulary, cum_weights=cum_weights, k=count)
+    lines = (' '.join(words[i:i + 12]) for i in range(0, len(words), 12))
+    plot = '\n'.join('  PL: ' + line for line in lines)
+    return '{} ({})\n  \n{}\n  \n  BY: benchmark\n'.format(title, year, plot)
+
+
+def generate_corpus(root, count, seed=0, vocabulary_size=5000,
+                    min_words=40, max_words=200):
+    """Write count synthetic plot files into root. Same seed always
+    generates same corpus. Returns vocabulary plots were generated from.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    cum_weights = zipf_cum_weights(len(vocabulary))
+    os.makedirs(root, exist_ok=True)
+    for number in range(count):
+        text = generate_plot(rng, vocabulary, cum_weights,
+                             min_words, max_words)
+        with open(os.path.join(root, 'plot-{:08d}'.format(number)), 'w') as fp:
+            fp.write(text)
+    return vocabulary
+
+
+def generate_queries(vocabulary, count, seed=0, max_terms=3):
+    rng = random.Random(seed)
+    cum_weights = zipf_cum_weights(len(vocabulary))
+    return [' '.join(rng.choices(vocabulary, cum_weights=cum_weights,
+                                 k=rng.randint(1, max_terms)))
+            for _ in range(count)]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * pct / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    fraction = position - lower
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+def measure_register(controller, root, documents):
+    start = time.perf_counter()
+    controller.register(root)
+    elapsed = time.perf_counter() - start
+    return {'documents': documents, 'seconds': elapsed,
+            'documents_per_second': documents / elapsed}
+
+
+def measure_index(controller):
+    start = time.perf_counter()
+    postings = controller.index()
+    elapsed = time.perf_counter() - start
+    return {'postings': postings, 'seconds': elapsed,
+            'postings_per_second': postings / elapsed}
+
+
+def measure_query(controller, queries):
+    latencies = []
+    start = time.perf_counter()
+    for query_string in queries:
+        query_start = time.perf_counter()
+        controller.search(query_string)
+        latencies.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start
+    return {'queries': len(queries), 'seconds': elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'qps': len(queries) / elapsed}
+
+
+def import_sqlite_csv(index_store):
+    """Load generated indexes into index database, the step users do by hand
+    using sqlite3 .import command
+    """
+    query = 'INSERT INTO indexes (id, document_id, word, rank) ' \
+            'VALUES (?, ?, ?, ?)'
+    with open(index_store.csv_buffer) as fp:
+        index_store.db.executemany(query, csv.reader(fp))
+    index_store.db.commit()
+    os.remove(index_store.csv_buffer)
+
+
+def benchmark_config(config, backend, workdir):
+    config['default']['datastore'] = backend
+    if backend == 'sqlite3':
+        config['sqlite3']['documents'] = os.path.join(workdir, 'documents.db')
+        config['sqlite3']['indexes'] = os.path.join(workdir, 'indexes.db')
+    elif backend == 'mongo':
+        dbname = config.get('mongo', 'dbname')
+        config['mongo']['dbname'] = '{}_benchmark'.format(dbname)
+    return config
+
+
+def environment():
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=root, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    else:
+        commit = commit.decode().strip()
+    return {'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'timestamp': time.time()}
+
+
+def run_benchmark(config, corpus_root, documents, queries, workdir):
+    """Register, index and query corpus on datastore selected in config.
+    Datastores are recreated from scratch first.
+    """
+    backend = config.get('default', 'datastore')
+    controller = get_controller(config)
+    controller.init('all', force=True)
+    if backend == 'sqlite3':
+        controller.index_store.csv_buffer = os.path.join(workdir,
+                                                         'indexes.csv')
+
+    result = {'backend': backend}
+    result['register'] = measure_register(controller, corpus_root, documents)
+    result['index'] = measure_index(controller)
+    if backend == 'sqlite3':
+        import_sqlite_csv(controller.index_store)
+    result['query'] = measure_query(controller, queries)
+    result.update(environment())
+    return result
@@ -0,0 +1,89 @@
+import lzma
+import zlib
+
+
+CODECS = ('none', 'zlib', 'lzma')
+
+
+def check_codec(codec):
+    if codec not in CODECS:
+        msg = '"{}" is not valid compression codec, use one of {}'
+        raise ValueError(msg.format(codec, ', '.join(CODECS)))
+    return codec
+
+
+def compress(text, codec):
+    """Encode document content for storage. Uncompressed content is kept as
+    text, so stores without compression stay readable by hand.
+    """
+    if codec == 'none':
+        return text
+    data = text.encode('utf-8')
+    if codec == 'zlib':
+        return zlib.compress(data)
+    if codec == 'lzma':
+        return lzma.compress(data)
+    check_codec(codec)
+
+
+def decompress(data, codec):
+    if codec == 'none':
+        return data
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    if codec == 'lzma':
+        return lzma.decompress(data).decode('utf-8')
+    check_codec(codec)
+
+
+def iter_decompressed(data, codec, chunk_size=256):
+    """Yield decompressed content in chunks of at most chunk_size bytes, so
+    reading can stop early
+    """
+    if codec == 'zlib':
+        decompressor = zlib.decompressobj()
+    elif codec == 'lzma':
+        decompressor = lzma.LZMADecompressor()
+    else:
+        check_codec(codec)
+        raise ValueError('content stored with "{}" codec is not '
+                         'compressed'.format(codec))
+
+    pending = bytes(data)
+    while not decompressor.eof:
+        chunk = decompressor.decompress(pending, chunk_size)
+        pending = getattr(decompressor, 'unconsumed_tail', b'')
+        if not chunk:
+            break
+        yield chunk
+
+
+def decompress_prefix(data, codec, separator='\n', chunk_size=256):
+    """Decode content only up to first separator, without decompressing
+    whole document.
+    """
+    if codec == 'none':
+        return data.split(separator, 1)[0]
+
+    separator = separator.encode('utf-8')
+    prefix = b''
+    for chunk in iter_decompressed(data, codec, chunk_size):
+        prefix += chunk
+        if separator in prefix:
+            break
+    return prefix.split(separator, 1)[0].decode('utf-8', errors='ignore')
+
+
+def decompress_head(data, codec, length, chunk_size=4096):
+    """Decode only first length characters of content (bytes of encoded
+    content when compressed)
+    """
+    if codec == 'none':
+        return data[:length]
+
+    head = b''
+    for chunk in iter_decompressed(data, codec, chunk_size):
+        head += chunk
+        if len(head) >= length:
+            break
+    return head[:length].decode('utf-8', errors='ignore')
@@ -1,12 +1,43 @@
 import os
+import re
 import sys
+import json
+import heapq
+import base64
 import time
+import random
 import configparser
 from operator import itemgetter
 from itertools import chain, islice
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pkg_resources import resource_filename
 
-from searcher.utils import iterate_words, document_count, files_iterator
+from searcher.stats import Stats
+from searcher.deadline import Deadline, DeadlineExceeded
+from searcher.delta import DeltaIndex
+from searcher.dedup import content_hash, NearDuplicateIndex
+from searcher.terms import TermDictionary, WILDCARDS, literal_prefix, \
+    most_frequent
+from searcher.fuzzy import TrigramIndex
+from searcher.impacts import ImpactQuantizer, accumulate_impacts
+from searcher.document import GenericDocument
+from searcher.snippets import make_snippet
+from searcher.reorder import document_order, posting_gap_bytes
+from searcher.archive import ArchiveWriter, ArchiveReader, DOCUMENTS, \
+    POSTINGS
+from searcher.metadata import MetadataIndex, parse_title, parse_filter
+from searcher.utils import iterate_words, files_iterator
+
+
+TERM_DICTIONARY = 'terms'
+# trigram index with raw term id arrays, blob 'trigrams' of older
+# stores is not read and index is built from term dictionary instead
+TRIGRAM_INDEX = 'trigram_arrays'
+IMPACTS = 'impacts'
+CHECKPOINT = 'checkpoint'
+METADATA = 'metadata'
+FUZZY_TOKEN = re.compile(r'^(\w+)~(\d)?$')
 
 
 def load_config(path=None):
@@ -40,13 +71,225 @@ def mongo_controller(config):
     return MongoController(config)
 
 
+def search_batch_worker(config_dict, queries, limit):
+    config = configparser.ConfigParser()
+    config.read_dict(config_dict)
+    return get_controller(config).search_batch(queries, limit)
+
+
+def encode_cursor(score, document_id):
+    """Opaque cursor pointing right after result of given score and id"""
+    data = json.dumps([score, document_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        score, document_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return float(score), document_id
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('invalid cursor {!r}'.format(cursor))
+
+
 def invalid_controller(config):
     datastore = config.get('default', 'datastore')
     print('"{}" is not valid datastore type'.format(datastore), file=sys.stderr)
     sys.exit(1)
 
 
+class SearchResults(list):
+    """Ranked (document id, rank) pairs. Partial when query deadline
+    passed before all postings were fetched and counted.
+    """
+    def __init__(self, results=(), partial=False):
+        super().__init__(results)
+        self.partial = partial
+
+
 class Controller:
+    def __init__(self, config):
+        self.config = config
+        self.stats = Stats()
+        self.delta = DeltaIndex()
+        threshold = config.get('default', 'delta_merge_threshold',
+                               fallback='100000')
+        self.delta_merge_threshold = int(threshold)
+        self.deduplicate = config.getboolean('default', 'deduplicate',
+                                             fallback=True)
+        threshold = config.get('default', 'near_duplicate_threshold',
+                               fallback='0')
+        self.near_duplicate_threshold = float(threshold)
+        workers = config.get('default', 'query_workers', fallback='4')
+        self.query_workers = int(workers)
+        expansions = config.get('default', 'max_expansions', fallback='50')
+        self.max_expansions = int(expansions)
+        self.__executor = None
+        self.fuzzy_distance = int(config.get('default', 'fuzzy_distance',
+                                             fallback='1'))
+        self.fuzzy_penalty = float(config.get('default', 'fuzzy_penalty',
+                                              fallback='0.5'))
+        self.fuzzy_fallback = config.getboolean('default', 'fuzzy_fallback',
+                                                fallback=False)
+        self.__term_dictionary = None
+        self.__trigram_index = None
+        self.__tombstones = None
+        self.quantization = int(config.get('default', 'quantization',
+                                           fallback='0'))
+        self.__impact_bits = None
+        self.__metadata = None
+        self.prune_top_n = int(config.get('default', 'prune_top_n',
+                                          fallback='0'))
+        self.prune_threshold = float(config.get('default', 'prune_threshold',
+                                                fallback='0'))
+        self.prune_sample_queries = int(config.get(
+            'default', 'prune_sample_queries', fallback='200'))
+        self.checkpoint_interval = int(config.get(
+            'default', 'checkpoint_interval', fallback='10000'))
+        self.query_timeout_ms = int(config.get('default', 'query_timeout_ms',
+                                               fallback='0'))
+        self.snippet_words = int(config.get('default', 'snippet_words',
+                                            fallback='30'))
+        self.snippet_scan_chars = int(config.get(
+            'default', 'snippet_scan_chars', fallback='20000'))
+
+    @property
+    def executor(self):
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(self.query_workers)
+        return self.__executor
+
+    @property
+    def term_dictionary(self):
+        if self.__term_dictionary is None:
+            data = self.index_store.load_blob(TERM_DICTIONARY)
+            if data:
+                self.__term_dictionary = TermDictionary.from_bytes(data)
+            else:
+                self.__term_dictionary = TermDictionary()
+        return self.__term_dictionary
+
+    @property
+    def tombstones(self):
+        """Ids of deleted documents whose indexes were not purged yet"""
+        if self.__tombstones is None:
+            self.__tombstones = self.document_store.tombstones()
+        return self.__tombstones
+
+    @property
+    def impact_bits(self):
+        """Bits of integer impacts stored in index store, 0 when index
+        stores float ranks
+        """
+        if self.__impact_bits is None:
+            data = self.index_store.load_blob(IMPACTS)
+            self.__impact_bits = int(data) if data else self.quantization
+        return self.__impact_bits
+
+    def save_impact_bits(self, bits):
+        self.index_store.check_impact_bits(bits)
+        self.index_store.save_blob(IMPACTS, str(bits).encode())
+        self.__impact_bits = bits
+
+    def impacts(self, index_document):
+        """Postings of indexed document in form stored by index store"""
+        if self.impact_bits:
+            return ImpactQuantizer(self.impact_bits)(index_document)
+        return index_document
+
+    @property
+    def trigram_index(self):
+        if self.__trigram_index is None:
+            data = self.index_store.load_blob(TRIGRAM_INDEX)
+            if data:
+                self.__trigram_index = TrigramIndex.from_bytes(data)
+            else:
+                self.__trigram_index = TrigramIndex.build(
+                    term for term, _ in self.term_dictionary)
+        return self.__trigram_index
+
+    def save_term_dictionary(self, dictionary, new_terms=None):
+        """Store term dictionary together with trigram index over its
+        terms used by fuzzy queries. When dictionary only gained
+        new_terms, they are added to current trigram index instead of
+        indexing whole vocabulary again.
+        """
+        with self.stats.timer('index.terms'):
+            if new_terms is None:
+                trigram_index = TrigramIndex.build(term for term, _
+                                                   in dictionary)
+            else:
+                trigram_index = self.trigram_index
+                trigram_index.add(new_terms)
+            self.index_store.save_blob(TERM_DICTIONARY, dictionary.to_bytes())
+            self.index_store.save_blob(TRIGRAM_INDEX, trigram_index.to_bytes())
+        self.__term_dictionary = dictionary
+        self.__trigram_index = trigram_index
+
+    def merge_term_frequencies(self, frequencies):
+        """Add document frequencies of merged postings to term dictionary"""
+        dictionary = self.term_dictionary
+        new_terms = [term for term in frequencies
+                     if not dictionary.frequency(term)]
+        self.save_term_dictionary(dictionary.merged(frequencies), new_terms)
+
+    @property
+    def metadata(self):
+        """Bitmap index of document years and types. Rebuilt from stored
+        documents when missing in index store.
+        """
+        if self.__metadata is None:
+            data = self.document_store.load_blob(METADATA)
+            if data:
+                self.__metadata = MetadataIndex.from_bytes(data)
+            else:
+                self.rebuild_metadata()
+        return self.__metadata
+
+    def add_metadata(self, metadata, document_ids, contents):
+        with self.stats.timer('register.metadata'):
+            for document_id, content in zip(document_ids, contents):
+                metadata.add(document_id,
+                             parse_title(content.split('\n', 1)[0]))
+
+    def save_metadata(self):
+        self.document_store.save_blob(METADATA, self.metadata.to_bytes())
+
+    def rebuild_metadata(self):
+        """Build metadata index from title lines of all stored documents"""
+        self.__metadata = MetadataIndex()
+        batches = self.document_store.iter_documents(
+            self.document_batch_load_size)
+        for batch in batches:
+            ids = [document_id for document_id, _ in batch]
+            self.add_metadata(self.__metadata, ids,
+                              [content for _, content in batch])
+        self.save_metadata()
+
+    def parse_filters(self, query_string):
+        """Bitmap of documents passing filters of query string, None when
+        query has no filters
+        """
+        filters = [parse_filter(token) for token in query_string.split()]
+        filters = [query_filter for query_filter in filters if query_filter]
+        if not filters:
+            return None
+        with self.stats.timer('query.filter'):
+            return self.metadata.select(filters)
+
+    def filter_postings(self, postings, allowed):
+        """Keep only hits of documents in allowed bitmap"""
+        metadata = self.metadata
+        with self.stats.timer('query.filter'):
+            return {word: [hit for hit in hits
+                           if metadata.allows(allowed, hit[0])]
+                    for word, hits in postings.items()}
+
+    def rebuild_term_dictionary(self):
+        """Build term dictionary from postings already in index store"""
+        frequencies = dict(self.index_store.term_frequencies())
+        self.save_term_dictionary(TermDictionary.build(frequencies))
+
     def init(self, component, force=False):
         if force:
             if component in ['documents', 'all']:
@@ -55,74 +298,906 @@ class Controller:
             if component in ['indexes', 'all']:
                 self.index_store.clear()
                 self.index_store.init()
+            self.forget_caches()
         else:
             if component in ['documents', 'all']:
                 self.document_store.init()
             if component in ['indexes', 'all']:
                 self.index_store.init()
 
-    def register(self, root):
-        document_store = self.document_store
-        documents_to_store, counter = [], 0
-        msg = 'registering documents... {}/{}'
-        document_total_count = document_count(root)
+    def forget_caches(self):
+        """Drop data loaded from index and document stores, so it is read
+        again after stores were cleared
+        """
+        self.__term_dictionary = None
+        self.__trigram_index = None
+        self.__tombstones = None
+        self.__impact_bits = None
+        self.__metadata = None
+
+    def register(self, root, realtime=False):
+        """Store all documents found in root. With realtime set, documents
+        are also indexed into in-memory delta index and can be found by
+        query right away. Documents with same content as already stored
+        ones are skipped when deduplication is enabled.
+        """
+        stats = self.stats
+        contents, hashes, seen, counter = [], [], set(), 0
+        near_duplicates = None
+        if self.near_duplicate_threshold:
+            near_duplicates = NearDuplicateIndex(self.near_duplicate_threshold)
         for relative_path in files_iterator(root):
-            with open(relative_path, errors='ignore') as fp:
-                new_doc = document_store.prepare_document_query(fp.read())
-                documents_to_store.append(new_doc)
-                counter += 1
-                print(msg.format(counter, document_total_count), end='\r')
-            if len(documents_to_store) == self.document_batch_store_size:
-                document_store.store_documents(documents_to_store)
-                documents_to_store = []
-        document_store.store_documents(documents_to_store)
+            with stats.timer('register.read'):
+                with open(relative_path, errors='ignore') as fp:
+                    content = fp.read()
+            counter += 1
+            stats.incr('register.documents')
+            stats.incr('register.characters', len(content))
+            if self.deduplicate:
+                with stats.timer('register.hash'):
+                    digest = content_hash(content)
+                if digest in seen:
+                    stats.incr('register.duplicates')
+                    continue
+                seen.add(digest)
+                if near_duplicates is not None:
+                    with stats.timer('register.minhash'):
+                        similar = near_duplicates.find_or_add(digest, content)
+                    if similar is not None:
+                        stats.incr('register.near_duplicates')
+                        continue
+            else:
+                digest = None
+            contents.append(content)
+            hashes.append(digest)
+            if len(contents) == self.document_batch_store_size:
+                self.store_documents(contents, hashes, realtime)
+                contents, hashes = [], []
+        self.store_documents(contents, hashes, realtime)
+        self.save_metadata()
         print('registered {} documents from {}'.format(counter, root))
+        print(stats.report('register'))
+
+    def store_documents(self, contents, hashes, realtime=False):
+        if self.deduplicate and contents:
+            with self.stats.timer('register.hash'):
+                stored = self.document_store.find_hashes(hashes)
+            if stored:
+                self.stats.incr('register.duplicates', len(stored))
+                pairs = [(content, digest)
+                         for content, digest in zip(contents, hashes)
+                         if digest not in stored]
+                contents = [content for content, _ in pairs]
+                hashes = [digest for _, digest in pairs]
+        if not contents:
+            return []
+        document_store = self.document_store
+        documents_to_store = [document_store.prepare_document_query(c, h)
+                              for c, h in zip(contents, hashes)]
+        # metadata missing in document store is rebuilt before new documents
+        # are stored, so they are not added twice
+        metadata = self.metadata
+        with self.stats.timer('register.store'):
+            ids = document_store.store_documents(documents_to_store)
+        self.add_metadata(metadata, ids, contents)
+        if realtime:
+            self.index_delta(ids, contents)
+        return ids
+
+    def index_delta(self, document_ids, contents):
+        with self.stats.timer('register.index_delta'):
+            for document_id, content in zip(document_ids, contents):
+                document = GenericDocument(document_id, content)
+                document.indexer.index_document()
+                self.delta.register_document_indexes(
+                    self.impacts(document.indexer))
+        if len(self.delta) >= self.delta_merge_threshold:
+            self.merge_delta()
+
+    def merge_delta(self):
+        """Fold delta index into index store. Returns number of merged
+        postings.
+        """
+        merged = len(self.delta)
+        if merged:
+            with self.stats.timer('register.merge_delta'):
+                self.index_store.merge_indexes(self.delta)
+            self.merge_term_frequencies(self.delta.frequencies())
+            self.delta.clear()
+            self.stats.incr('register.merged_postings', merged)
+        return merged
+
+    def delete(self, document_ids):
+        """Delete documents. Their indexes stay in index store until purge,
+        queries skip them meanwhile.
+        """
+        deleted = self.document_store.delete_documents(document_ids)
+        self.__tombstones = None
+        print('deleted {} documents'.format(len(deleted)))
+        return deleted
+
+    def update(self, document_id, path):
+        """Replace document by content of file. Updated document gets new
+        id and is searchable right away. With deduplication enabled,
+        document is kept when same content is already stored.
+        """
+        with open(path, errors='ignore') as fp:
+            content = fp.read()
+        digest = content_hash(content) if self.deduplicate else None
+        if digest and self.document_store.find_hashes([digest]):
+            print('document {} not updated, same content already stored'
+                  .format(document_id))
+            return []
+        self.delete([document_id])
+        document_ids = self.store_documents([content], [digest], True)
+        self.save_metadata()
+        self.merge_delta()
+        if document_ids:
+            print('document {} updated as {}'.format(document_id,
+                                                     document_ids[0]))
+        return document_ids
+
+    def purge(self):
+        """Remove indexes of deleted documents from index store"""
+        self.merge_delta()
+        tombstones = self.document_store.tombstones()
+        if tombstones:
+            self.index_store.purge(tombstones)
+            self.rebuild_term_dictionary()
+            self.document_store.clear_tombstones(tombstones)
+        self.__tombstones = None
+        print('purged indexes of {} deleted documents'.format(len(tombstones)))
+        return len(tombstones)
+
+    def export_archive(self, path, order=None):
+        """Stream all documents and posting lists into archive file, which
+        can be imported into any datastore type. Documents are written in
+        order of given ids, if any.
+        """
+        self.merge_delta()
+        with open(path, 'wb') as fp, self.stats.timer('export.write'):
+            writer = ArchiveWriter(fp, self.impact_bits)
+            if order is None:
+                batches = self.document_store.iter_documents(
+                    self.document_batch_load_size)
+            else:
+                size = self.document_batch_load_size
+                batches = ([(document.document_id, document.content)
+                            for document in self.document_store
+                            .load_documents(order[start:start + size])]
+                           for start in range(0, len(order), size))
+            for batch in batches:
+                for document_id, content in batch:
+                    writer.add_document(document_id, content)
+            for word, hits in self.index_store.iter_postings():
+                writer.add_postings(word, hits)
+            writer.close()
+        print('exported {} documents and {} postings to {}'.format(
+            len(writer.ordinals), writer.postings, path))
+
+    def import_archive(self, path, batch_size=100000):
+        """Load documents and posting lists of archive. Documents get new
+        ids and postings are remapped to them, no document is tokenized.
+        """
+        ids, contents, indexes = [], [], []
+        frequencies = Counter()
+        with open(path, 'rb') as fp:
+            reader = ArchiveReader(fp)
+            if reader.impact_bits != self.quantization:
+                raise ValueError('archive ranks are quantized to {} bits, set '
+                                 'quantization = {} before import'.format(
+                                     reader.impact_bits, reader.impact_bits))
+            self.save_impact_bits(reader.impact_bits)
+            for kind, record in reader:
+                if kind == DOCUMENTS:
+                    contents.append(record)
+                    if len(contents) == self.document_batch_store_size:
+                        ids.extend(self.import_documents(contents))
+                        contents = []
+                elif kind == POSTINGS:
+                    if contents:
+                        ids.extend(self.import_documents(contents))
+                        contents = []
+                    word, hits = record
+                    frequencies[word] += len(hits)
+                    indexes.extend((ids[ordinal], word, rank)
+                                   for ordinal, rank in hits)
+                    if len(indexes) >= batch_size:
+                        self.index_store.merge_indexes(indexes)
+                        indexes = []
+            ids.extend(self.import_documents(contents))
+            self.index_store.merge_indexes(indexes)
+        self.merge_term_frequencies(frequencies)
+        self.save_metadata()
+        print('imported {} documents and {} postings from {}'.format(
+            len(ids), sum(frequencies.values()), path))
+        return len(ids)
+
+    def import_documents(self, contents):
+        """Store documents without skipping duplicates, keeping them
+        aligned with document numbers of archive
+        """
+        if not contents:
+            return []
+        document_store = self.document_store
+        documents = [document_store.prepare_document_query(
+                         content,
+                         content_hash(content) if self.deduplicate else None)
+                     for content in contents]
+        metadata = self.metadata
+        with self.stats.timer('import.store'):
+            ids = document_store.store_documents(documents)
+        self.add_metadata(metadata, ids, contents)
+        return ids
+
+    def reorder(self, by='title', path='reorder.archive', sample_size=None):
+        """Renumber documents so similar ones get nearby ids, by title or
+        by shared terms. Stores are rewritten through archive file in new
+        order. Prints size of posting id gaps, size of index store and
+        query latency before and after.
+        """
+        if self.impact_bits != self.quantization:
+            raise ValueError('index ranks are quantized to {} bits, set '
+                             'quantization = {} before reorder'.format(
+                                 self.impact_bits, self.impact_bits))
+        if sample_size is None:
+            sample_size = self.prune_sample_queries
+        self.merge_delta()
+        queries = self.sample_queries(sample_size)
+        before = self.measure_layout(queries)
+
+        with self.stats.timer('reorder.order'):
+            batches = self.document_store.iter_documents(
+                self.document_batch_load_size)
+            order = document_order(chain.from_iterable(batches), by)
+        self.export_archive(path, order)
+        self.init('all', force=True)
+        self.import_archive(path)
+        os.remove(path)
+        after = self.measure_layout(queries)
+
+        print('posting id gaps {} -> {} bytes, index store {} -> {} bytes'
+              .format(before['gap_bytes'], after['gap_bytes'],
+                      before['index_bytes'], after['index_bytes']))
+        print('median latency of {} sample queries {:.3f} -> {:.3f} ms'
+              .format(len(queries), before['p50_ms'], after['p50_ms']))
+        return {'before': before, 'after': after}
 
-    def index(self):
-        msg = 'indexing documents... {}/{}'
-        document_total_count = len(self.document_store)
-        for count, document_id in enumerate(self.document_store, 1):
-            document = self.document_store.load_document(document_id)
-            document.indexer.index_document()
-            self.index_store.register_document_indexes(document.indexer)
-            print(msg.format(count, document_total_count), end='\r')
+    def measure_layout(self, queries):
+        """Bytes of varint encoded id gaps of all posting lists, size of
+        index store and median latency of queries
+        """
+        ordinals = {str(document_id): position for position, document_id
+                    in enumerate(sorted(self.document_store))}
+        gap_bytes = posting_gap_bytes(self.index_store.iter_postings(),
+                                      ordinals)
+        postings, index_bytes = self.index_store.size()
+        latencies = []
+        for query_string in queries:
+            start = time.perf_counter()
+            self.search(query_string)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+        return {'postings': postings, 'gap_bytes': gap_bytes,
+                'index_bytes': index_bytes, 'p50_ms': p50}
+
+    def sample_queries(self, count, seed=0):
+        """Random one and two term queries over indexed vocabulary"""
+        terms = [term for term, _ in self.term_dictionary]
+        if not terms:
+            return []
+        rng = random.Random(seed)
+        return [' '.join(rng.sample(terms, min(rng.randint(1, 2), len(terms))))
+                for _ in range(count)]
+
+    def full_rankings(self, queries, limit):
+        """Best limit documents of every query ranked from whole posting
+        lists, not only best hits of every term
+        """
+        parsed = [self.parse_query(query) for query in queries]
+        words = [word for query_parts in parsed for word, _ in query_parts]
+        postings = self.fetch_query_postings(words)
+        return [self.rank(query_parts, postings, limit,
+                          self.parse_filters(query))
+                for query, query_parts in zip(queries, parsed)]
+
+    def prune(self, top_n=None, threshold=None, sample_size=None):
+        """Statically prune index store, keeping only top_n postings of
+        every term and/or postings ranked at least threshold. Threshold is
+        float rank, scaled to impact when index is quantized. Prints size
+        reduction and recall of sample queries against their exact
+        rankings over full index.
+        """
+        top_n = self.prune_top_n if top_n is None else top_n
+        threshold = self.prune_threshold if threshold is None else threshold
+        if sample_size is None:
+            sample_size = self.prune_sample_queries
+        if not top_n and not threshold:
+            print('Nothing to prune, set prune_top_n or prune_threshold')
+            return None
+        if threshold and self.impact_bits:
+            threshold = ImpactQuantizer(self.impact_bits).quantize(threshold)
+
+        queries = self.sample_queries(sample_size)
+        limit = int(self.config.get('default', 'query_limit'))
+        full_results = self.full_rankings(queries, limit)
+        postings_before, size_before = self.index_store.size()
+        with self.stats.timer('index.prune'):
+            self.index_store.prune(top_n or None, threshold or None)
+        postings_after, size_after = self.index_store.size()
+        self.rebuild_term_dictionary()
+        pruned_results = self.search_batch(queries, limit)
+
+        recalls = []
+        for full, pruned in zip(full_results, pruned_results):
+            if full:
+                full_ids = {doc_id for doc_id, _ in full}
+                pruned_ids = {doc_id for doc_id, _ in pruned}
+                recalls.append(len(full_ids & pruned_ids) / len(full_ids))
+        recall = sum(recalls) / len(recalls) if recalls else 1.0
+
+        report = {'postings_before': postings_before,
+                  'postings_after': postings_after,
+                  'bytes_before': size_before, 'bytes_after': size_after,
+                  'queries': len(queries), 'recall': recall}
+        reduction = 1 - postings_after / postings_before \
+            if postings_before else 0
+        print('pruned postings {} -> {} ({:.1%} smaller), '
+              'bytes {} -> {}'.format(postings_before, postings_after,
+                                      reduction, size_before, size_after))
+        print('recall against full index over {} sample queries: '
+              '{:.4f}'.format(len(queries), recall))
+        return report
+
+    def save_checkpoint(self, document_id, count, postings, frequencies):
+        """Make postings of documents indexed so far durable and remember
+        last indexed document, so interrupted index run can be resumed
+        """
+        with self.stats.timer('index.checkpoint'):
+            state = self.index_store.checkpoint()
+            state.update(document=str(document_id), count=count,
+                         postings=postings)
+            header = json.dumps(state).encode('utf-8')
+            terms = TermDictionary.build(frequencies).to_bytes()
+            self.index_store.save_blob(CHECKPOINT, header + b'\n' + terms)
+        self.stats.incr('index.checkpoints')
+
+    def load_checkpoint(self):
+        """State of interrupted index run and document frequencies of
+        terms counted until then, (None, empty Counter) without checkpoint
+        """
+        data = self.index_store.load_blob(CHECKPOINT)
+        if not data:
+            return None, Counter()
+        header, terms = bytes(data).split(b'\n', 1)
+        frequencies = Counter(dict(TermDictionary.from_bytes(terms)))
+        return json.loads(header.decode('utf-8')), frequencies
+
+    def index(self, resume=False):
+        stats = self.stats
+        checkpoint, frequencies = None, Counter()
+        if resume:
+            checkpoint, frequencies = self.load_checkpoint()
+            if checkpoint is None:
+                print('no checkpoint found, indexing all documents')
+        if checkpoint is None:
+            after, count, postings = None, 0, 0
+            self.index_store.delete_blob(CHECKPOINT)
+            self.save_impact_bits(self.quantization)
+        else:
+            after = checkpoint['document']
+            count, postings = checkpoint['count'], checkpoint['postings']
+            print('resuming index run after {} documents'.format(count))
+        self.index_store.begin(checkpoint)
+        batches = self.document_store.iter_documents(
+            self.document_batch_load_size, after)
+        for batch in stats.timed_iter('index.load', batches):
+            for document_id, content in batch:
+                document = GenericDocument(document_id, content)
+                with stats.timer('index.tokenize'):
+                    words = list(document)
+                with stats.timer('index.count'):
+                    document.indexer.index_words(words)
+                with stats.timer('index.store'):
+                    self.index_store.register_document_indexes(
+                        self.impacts(document.indexer))
+                frequencies.update(document.indexer.index.keys())
+                count += 1
+                postings += len(document.indexer.index)
+                stats.incr('index.documents')
+                stats.incr('index.tokens', len(words))
+                stats.incr('index.postings', len(document.indexer.index))
+                if self.checkpoint_interval and \
+                        count % self.checkpoint_interval == 0:
+                    self.save_checkpoint(document_id, count, postings,
+                                         frequencies)
         print('indexed {} documents from datastore'.format(count))
-        self.index_store.flush()
+        with stats.timer('index.store'):
+            self.index_store.flush()
+        self.save_term_dictionary(TermDictionary.build(frequencies))
+        self.index_store.delete_blob(CHECKPOINT)
+        print(stats.report('index'))
+        return postings
 
     def show(self, document_ids, preview=True):
-        documents = map(self.document_store.load_document, document_ids)
+        documents = self.document_store.load_documents(document_ids)
         for doc in documents:
             if preview:
                 print(doc.preview)
             else:
                 print(doc.content)
 
-    def query(self, query_string, measure=False, preview=False):
-        query_limit = int(self.config.get('default', 'query_limit'))
+    def snippets(self, query_string, document_ids):
+        """(document, snippet) pairs of documents loaded at once. Snippets
+        are searched only in bounded head of every document.
+        """
+        terms = {word for word, _ in self.parse_query(query_string)}
+        documents = self.document_store.load_documents(document_ids)
+        with self.stats.timer('query.snippets'):
+            return [(document,
+                     make_snippet(document.head(self.snippet_scan_chars),
+                                  terms, self.snippet_words))
+                    for document in documents]
 
-        if measure:
-            start = time.clock()
-
-        query_parts = list(iterate_words(query_string))
-        result_parts = [self.index_store.find_by_word(word, query_limit)
-                        for word in query_parts]
-        all_results_iterable = chain.from_iterable(result_parts)
-        document_rank = dict()
-        for doc_id, rank in all_results_iterable:
-            if doc_id in document_rank:
-                document_rank[doc_id] += rank
+    def fetch_postings(self, words, limit=None, deadline=None):
+        """Fetch posting lists of all distinct words concurrently, so query
+        latency is bound by the slowest term instead of sum of all terms.
+        Index store interrupts lookups when deadline passes, their words
+        are left out.
+        """
+        words = list(dict.fromkeys(words))
+
+        def fetch(word):
+            if deadline is None:
+                return list(self.index_store.find_by_word(word, limit))
+            try:
+                return list(self.index_store.find_by_word(
+                    word, limit, deadline=deadline))
+            except DeadlineExceeded:
+                return None
+
+        if self.query_workers > 1 and len(words) > 1:
+            fetched = self.executor.map(fetch, words)
+        else:
+            fetched = map(fetch, words)
+        return {word: hits for word, hits in zip(words, fetched)
+                if hits is not None}
+
+    def merge_delta_hits(self, postings, limit=None):
+        merged = dict()
+        for word, hits in postings.items():
+            delta_hits = self.delta.find_by_word(word, limit)
+            if delta_hits:
+                hits = sorted(chain(hits, delta_hits), key=itemgetter(1),
+                              reverse=True)
+                hits = hits[:limit] if limit else hits
+            merged[word] = hits
+        return merged
+
+    def parse_query(self, query_string):
+        """Split query into (index term, weight) pairs. Query words
+        containing * or ? wildcards are expanded to most frequent matching
+        terms of term dictionary. Words ending with ~ (optionally followed
+        by maximal edit distance) are expanded to similar terms, weighted
+        down by fuzzy_penalty per edit.
+        """
+        query_parts = []
+        for token in query_string.split():
+            if parse_filter(token):
+                continue
+            fuzzy = FUZZY_TOKEN.match(token)
+            if fuzzy:
+                word, distance = fuzzy.groups()
+                distance = int(distance or self.fuzzy_distance)
+                for term in iterate_words(word):
+                    query_parts.extend(self.expand_fuzzy(term, distance))
+            elif any(wildcard in token for wildcard in WILDCARDS):
+                pattern = re.sub(r'[^\w*?]', '', token.lower())
+                expansions = self.expand_wildcard(pattern)
+                self.stats.incr('query.expansions', len(expansions))
+                query_parts.extend((term, 1.0) for term, _ in expansions)
             else:
-                document_rank[doc_id] = rank
+                for term in iterate_words(token):
+                    if self.fuzzy_fallback and \
+                            not self.term_dictionary.frequency(term):
+                        distance = self.fuzzy_distance
+                        query_parts.extend(self.expand_fuzzy(term, distance))
+                    else:
+                        query_parts.append((term, 1.0))
+        return query_parts
+
+    def expand_wildcard(self, pattern):
+        """Most frequent terms matching wildcard pattern. Patterns starting
+        with wildcard are looked up in trigram index, as term dictionary
+        can only be searched by prefix.
+        """
+        if literal_prefix(pattern):
+            return self.term_dictionary.expand(pattern, self.max_expansions)
+        terms = self.trigram_index.match(pattern)
+        if terms is None:
+            raise ValueError('pattern {!r} starting with wildcard needs '
+                             'three letters in a row'.format(pattern))
+        return most_frequent([(term, self.term_dictionary.frequency(term))
+                              for term in terms], self.max_expansions)
+
+    def expand_fuzzy(self, term, max_distance):
+        with self.stats.timer('query.fuzzy'):
+            matches = self.trigram_index.search(term, max_distance)
+        self.stats.incr('query.expansions', len(matches))
+        return [(match, self.fuzzy_penalty ** distance)
+                for match, distance in matches[:self.max_expansions]]
+
+    def search(self, query_string, limit=None, timeout_ms=None):
+        """Rank documents matching query string. Returns SearchResults,
+        list of (document id, rank) pairs ordered by rank. With year: or
+        type: filters in query, whole posting lists are fetched and
+        narrowed to matching documents before scoring. When timeout_ms
+        (default query_timeout_ms) passes, best results found so far are
+        returned marked partial.
+        """
+        if limit is None:
+            limit = int(self.config.get('default', 'query_limit'))
+        if timeout_ms is None:
+            timeout_ms = self.query_timeout_ms
+        deadline = Deadline(timeout_ms) if timeout_ms else None
+
+        stats = self.stats
+        with stats.timer('query.parse'):
+            query_parts = self.parse_query(query_string)
+            allowed = self.parse_filters(query_string)
+        fetch_limit = limit if allowed is None else None
+        words = [word for word, _ in query_parts]
+        postings = self.fetch_query_postings(words, fetch_limit, deadline)
+        stats.incr('query.queries')
+        stats.incr('query.terms', len(query_parts))
+        stats.incr('query.duplicate_terms', len(words) - len(set(words)))
+        results = self.rank(query_parts, postings, limit, allowed, deadline)
+        if len(postings) < len(set(words)):
+            results.partial = True
+        if results.partial:
+            stats.incr('query.partial')
+        return results
+
+    def fetch_query_postings(self, words, limit=None, deadline=None):
+        """Posting lists of words. Deleted documents are skipped only when
+        ranking, so lists with deleted documents among their limit best
+        hits are fetched deeper until they hold limit live hits.
+        """
+        with self.stats.timer('query.fetch'):
+            postings = self.fetch_merged_postings(words, limit, deadline)
+            tombstones = self.tombstones
+            depth = limit
+            while limit and tombstones:
+                deeper = dict()
+                for word, hits in postings.items():
+                    live = sum(doc_id not in tombstones for doc_id, _ in hits)
+                    if len(hits) >= depth and live < limit:
+                        deeper[word] = len(hits) + limit - live
+                if not deeper:
+                    break
+                depth = max(deeper.values())
+                postings.update(self.fetch_merged_postings(
+                    list(deeper), depth, deadline))
+        self.stats.incr('query.postings', sum(map(len, postings.values())))
+        return postings
+
+    def fetch_merged_postings(self, words, limit=None, deadline=None):
+        postings = self.fetch_postings(words, limit, deadline)
+        if len(self.delta):
+            postings = self.merge_delta_hits(postings, limit)
+        return postings
+
+    def live_hits(self, hits, limit):
+        """Best hits of posting list holding limit hits of documents not
+        deleted
+        """
+        tombstones, live = self.tombstones, 0
+        for position, (doc_id, _) in enumerate(hits):
+            if doc_id not in tombstones:
+                live += 1
+                if live == limit:
+                    return hits[:position + 1]
+        return hits
+
+    def rank(self, query_parts, postings, limit, allowed=None, deadline=None):
+        if allowed is not None:
+            postings = self.filter_postings(postings, allowed)
+        with self.stats.timer('query.score'):
+            if deadline is not None:
+                return self.rank_until(query_parts, postings, limit, deadline)
+            if self.impact_bits and \
+                    all(weight == 1.0 for _, weight in query_parts):
+                return SearchResults(accumulate_impacts(
+                    query_parts, postings, limit, self.tombstones))
+
+            document_rank = dict()
+            for word, weight in query_parts:
+                for doc_id, rank in postings[word]:
+                    if doc_id in document_rank:
+                        document_rank[doc_id] += rank * weight
+                    else:
+                        document_rank[doc_id] = rank * weight
 
+            for doc_id in self.tombstones.intersection(document_rank):
+                del document_rank[doc_id]
+
+            sorted_results = sorted(document_rank.items(), key=itemgetter(1),
+                                    reverse=True)
+            return SearchResults(islice(sorted_results, limit))
+
+    def rank_until(self, query_parts, postings, limit, deadline,
+                   chunk_size=1000):
+        """Sum weighted ranks taking next chunk_size best hits of every
+        term in turn. Hits are ordered by rank, so when deadline passes,
+        best hits of all terms are already counted. First chunk is always
+        counted, even when fetching used up whole time budget.
+        """
+        lists = [(postings.get(word, ()), weight)
+                 for word, weight in query_parts]
+        longest = max((len(hits) for hits, _ in lists), default=0)
+        document_rank, partial = dict(), False
+        for start in range(0, longest, chunk_size):
+            if start and deadline.expired:
+                partial = True
+                break
+            for hits, weight in lists:
+                for doc_id, rank in hits[start:start + chunk_size]:
+                    document_rank[doc_id] = document_rank.get(doc_id, 0) + \
+                        rank * weight
+
+        for doc_id in self.tombstones.intersection(document_rank):
+            del document_rank[doc_id]
         sorted_results = sorted(document_rank.items(), key=itemgetter(1),
                                 reverse=True)
-        results_with_ranks = islice(sorted_results, query_limit)
-        results = list(map(lambda did: str(did[0]), results_with_ranks))
+        return SearchResults(islice(sorted_results, limit), partial)
+
+    def search_page(self, query_string, cursor=None, limit=None,
+                    timeout_ms=None):
+        """Rank one page of documents matching query string, continuing
+        after cursor of previous page. Returns list of (document id, rank)
+        pairs ordered by rank and id, and cursor of next page or None.
+
+        Every term adds positive rank, so documents ranked below cursor
+        have no hit ranked above cursor rank divided by term weight. Only
+        hits under that bound are fetched, so cost of page does not grow
+        with its depth. Candidates are rescored from ranks of all query
+        terms, keeping their ranks equal on every page. Hits are fetched
+        deeper until no document not seen yet can outrank last document of
+        page. When timeout_ms passes, page is not searched deeper and is
+        marked partial.
+        """
+        if limit is None:
+            limit = int(self.config.get('default', 'query_limit'))
+        if timeout_ms is None:
+            timeout_ms = self.query_timeout_ms
+        deadline = Deadline(timeout_ms) if timeout_ms else None
+        after = decode_cursor(cursor) if cursor else None
+
+        with self.stats.timer('query.parse'):
+            query_parts = self.parse_query(query_string)
+            allowed = self.parse_filters(query_string)
+        weights = dict()
+        for word, weight in query_parts:
+            if weight > 0:
+                weights[word] = weights.get(word, 0) + weight
+        self.stats.incr('query.queries')
+        self.stats.incr('query.terms', len(query_parts))
+
+        depth, partial = limit, False
+        while True:
+            results, unseen = self.rank_page(weights, after, limit, depth,
+                                             allowed)
+            if unseen is None or \
+                    len(results) == limit and results[-1][1] > unseen:
+                break
+            if deadline is not None and deadline.expired:
+                partial = True
+                break
+            depth *= 2
+        next_cursor = None
+        if results and (len(results) == limit or partial):
+            next_cursor = encode_cursor(results[-1][1], results[-1][0])
+        return SearchResults(results, partial), next_cursor
+
+    def rank_page(self, weights, after, limit, depth, allowed=None):
+        """Best limit documents after cursor position, found among depth
+        best hits of every word under its bound. Second value is highest
+        rank any document not seen yet can have, None when all hits under
+        bounds were seen.
+        """
+        bounds = {word: after[0] / weight if after else None
+                  for word, weight in weights.items()}
+        postings = self.fetch_page_postings(bounds, depth)
+        unseen = None
+        if any(len(hits) >= depth for hits in postings.values()):
+            unseen = sum(hits[-1][1] * weights[word]
+                         for word, hits in postings.items()
+                         if len(hits) >= depth)
+        candidates = {doc_id for hits in postings.values()
+                      for doc_id, _ in hits}
+        candidates.difference_update(self.tombstones)
+        if allowed is not None:
+            candidates = {doc_id for doc_id in candidates
+                          if self.metadata.allows(allowed, doc_id)}
+        ranks = self.fetch_ranks(postings, candidates)
+
+        with self.stats.timer('query.score'):
+            scored = []
+            for doc_id in candidates:
+                score = 0
+                for word, weight in weights.items():
+                    if doc_id in ranks[word]:
+                        score += ranks[word][doc_id] * weight
+                key = (-score, doc_id)
+                if after is None or key > (-after[0], after[1]):
+                    scored.append(key)
+            best = heapq.nsmallest(limit, scored)
+        return [(doc_id, -score) for score, doc_id in best], unseen
+
+    def fetch_page_postings(self, bounds, depth):
+        """Depth best hits of every word ranked at most its bound"""
+        words = list(bounds)
+
+        def fetch(word):
+            return list(self.index_store.find_by_word(word, depth,
+                                                      bounds[word]))
+
+        with self.stats.timer('query.fetch'):
+            postings = dict(zip(words, self.executor.map(fetch, words)))
+            if len(self.delta):
+                for word in words:
+                    delta_hits = self.delta.find_by_word(word, depth,
+                                                         bounds[word])
+                    hits = sorted(chain(postings[word], delta_hits),
+                                  key=itemgetter(1), reverse=True)
+                    postings[word] = hits[:depth]
+        self.stats.incr('query.postings', sum(map(len, postings.values())))
+        return postings
 
-        if preview:
+    def fetch_ranks(self, postings, candidates):
+        """Ranks of every word in candidate documents, looking up only
+        those missing in fetched postings
+        """
+        ranks = dict()
+        with self.stats.timer('query.rescore'):
+            for word, hits in postings.items():
+                ranks[word] = dict(hits)
+                missing = candidates.difference(ranks[word])
+                if missing:
+                    ranks[word].update(
+                        self.index_store.find_ranks(word, missing))
+                    if len(self.delta):
+                        ranks[word].update(
+                            self.delta.find_ranks(word, missing))
+        return ranks
+
+    def search_batch(self, queries, limit=None, workers=1):
+        """Rank documents of many queries at once. Postings of every
+        distinct term are fetched only once for whole batch, whole posting
+        lists only for terms of queries with filters. With more workers,
+        batch is split among processes, each with its own term cache.
+        Returns list of results as returned by search.
+        """
+        if limit is None:
+            limit = int(self.config.get('default', 'query_limit'))
+        if workers > 1 and len(queries) > 1:
+            config = {section: dict(self.config[section])
+                      for section in self.config.sections()}
+            chunk_size = -(-len(queries) // workers)
+            chunks = [queries[i:i + chunk_size]
+                      for i in range(0, len(queries), chunk_size)]
+            with ProcessPoolExecutor(workers) as pool:
+                results = pool.map(search_batch_worker, [config] * len(chunks),
+                                   chunks, [limit] * len(chunks))
+                return list(chain.from_iterable(results))
+
+        with self.stats.timer('query.parse'):
+            parsed = [self.parse_query(query) for query in queries]
+            filters = [self.parse_filters(query) for query in queries]
+        return self.rank_batch(parsed, filters, limit)
+
+    def rank_batch(self, parsed, filters, limit):
+        """Rank parsed queries with their filters, as search_batch does"""
+        stats = self.stats
+        words = [word for query_parts in parsed for word, _ in query_parts]
+        whole = {word for query_parts, allowed in zip(parsed, filters)
+                 if allowed is not None for word, _ in query_parts}
+        postings = self.fetch_query_postings(
+            [word for word in words if word not in whole], limit)
+        if whole:
+            postings.update(self.fetch_query_postings(
+                [word for word in words if word in whole]))
+        stats.incr('query.queries', len(parsed))
+        stats.incr('query.terms', len(words))
+        stats.incr('query.duplicate_terms', len(words) - len(set(words)))
+        limited = postings
+        if whole and limit:
+            limited = dict(postings)
+            limited.update((word, self.live_hits(postings[word], limit))
+                           for word in whole if word in postings)
+        return [self.rank(query_parts,
+                          postings if allowed is not None else limited,
+                          limit, allowed)
+                for query_parts, allowed in zip(parsed, filters)]
+
+    def query(self, query_string, measure=False, preview=False,
+              paginate=False, cursor=None, snippets=False, timeout_ms=None):
+        if measure:
+            start = time.perf_counter()
+
+        next_cursor = None
+        if paginate or cursor:
+            results, next_cursor = self.search_page(query_string, cursor,
+                                                    timeout_ms=timeout_ms)
+        else:
+            results = self.search(query_string, timeout_ms=timeout_ms)
+        partial = results.partial
+        results = [str(doc_id) for doc_id, _ in results]
+
+        if snippets:
+            for document, snippet in self.snippets(query_string, results):
+                print(document.document_id, document.preview)
+                print('    {}'.format(snippet))
+        elif preview:
             self.show(results, preview=True)
         else:
             print(' '.join(results))
+        if partial:
+            print('partial results, query deadline passed')
+        if next_cursor:
+            print('next page: --after {}'.format(next_cursor))
 
         if measure:
-            print('Took {} to execute'.format(time.clock() - start))
+            print('Took {} to execute'.format(time.perf_counter() - start))
+            print(self.stats.report('query'))
+
+    def query_batch(self, path, workers=1):
+        """Run all queries from file and print results as JSON lines. File
+        is either plain text with one query per line, or JSON lines with
+        'query' and optional 'id' keys. Lines which can't be read or
+        parsed are printed with 'error' instead of 'results'.
+        """
+        records = []
+        with open(path) as fp:
+            for number, line in enumerate(fp, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                record = {'id': number, 'query': line}
+                if path.endswith('.jsonl'):
+                    try:
+                        data = json.loads(line)
+                        record = {'id': data.get('id', number),
+                                  'query': data['query']}
+                    except (ValueError, KeyError, AttributeError):
+                        record = {'id': number, 'query': None,
+                                  'error': 'invalid query line'}
+                records.append(record)
+
+        valid, parsed, filters = [], [], []
+        with self.stats.timer('query.parse'):
+            for record in records:
+                if 'error' in record:
+                    continue
+                try:
+                    query_parts = self.parse_query(record['query'])
+                    allowed = self.parse_filters(record['query'])
+                except ValueError as error:
+                    record['error'] = str(error)
+                    continue
+                valid.append(record)
+                parsed.append(query_parts)
+                filters.append(allowed)
+
+        if workers > 1:
+            results = self.search_batch([record['query'] for record in valid],
+                                        workers=workers)
+        else:
+            limit = int(self.config.get('default', 'query_limit'))
+            results = self.rank_batch(parsed, filters, limit)
+        for record, ranked in zip(valid, results):
+            record['results'] = [{'document': doc_id, 'rank': rank}
+                                 for doc_id, rank in ranked]
+        for record in records:
+            print(json.dumps(record))
@@ -0,0 +1,27 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Raised by index store lookup interrupted when query deadline
+    passed
+    """
+
+
+class Deadline:
+    """Point in time after which query stops fetching and counting
+    postings
+    """
+    def __init__(self, timeout_ms):
+        self.expires = time.perf_counter() + timeout_ms / 1000
+
+    def remaining(self):
+        """Seconds left until deadline, never negative"""
+        return max(self.expires - time.perf_counter(), 0)
+
+    def remaining_ms(self):
+        """Whole milliseconds left, at least 1 until deadline passes"""
+        return max(int(self.remaining() * 1000), 1)
+
+    @property
+    def expired(self):
+        return time.perf_counter() >= self.expires
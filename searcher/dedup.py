@@ -0,0 +1,71 @@
+import re
+import random
+import hashlib
+from zlib import crc32
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def content_hash(content):
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def shingles(content, size=3):
+    words = re.findall(r'\w+', content.lower())
+    if len(words) < size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHash:
+    """MinHash signatures estimating Jaccard similarity of word shingles"""
+    def __init__(self, num_perm=64, seed=1, shingle_size=3):
+        rng = random.Random(seed)
+        self.shingle_size = shingle_size
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME),
+                              rng.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, content):
+        hashes = [crc32(shingle.encode('utf-8'))
+                  for shingle in shingles(content, self.shingle_size)]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes)
+                     for a, b in self.permutations)
+
+    @staticmethod
+    def similarity(signature, other):
+        same = sum(1 for a, b in zip(signature, other) if a == b)
+        return same / len(signature)
+
+
+class NearDuplicateIndex:
+    """Locality sensitive hashing over MinHash signatures. Signatures are
+    split into bands, documents sharing any band are candidates and are
+    confirmed by estimated similarity.
+    """
+    def __init__(self, threshold, num_perm=64, bands=16):
+        self.threshold = threshold
+        self.minhash = MinHash(num_perm)
+        self.rows = num_perm // bands
+        self.buckets = [dict() for _ in range(bands)]
+
+    def band_keys(self, signature):
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows]
+                for i in range(len(self.buckets))]
+
+    def find_or_add(self, key, content):
+        """Return key of near duplicate document if one was added before,
+        otherwise remember this document and return None
+        """
+        signature = self.minhash.signature(content)
+        band_keys = self.band_keys(signature)
+        for bucket, band_key in zip(self.buckets, band_keys):
+            for other_key, other_signature in bucket.get(band_key, ()):
+                similarity = MinHash.similarity(signature, other_signature)
+                if similarity >= self.threshold:
+                    return other_key
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket.setdefault(band_key, []).append((key, signature))
+        return None
@@ -0,0 +1,44 @@
+from operator import itemgetter
+from collections import defaultdict
+
+
+class DeltaIndex:
+    """In-memory index segment holding postings of documents registered
+    since last merge into index store. Makes new documents searchable
+    without full index run.
+    """
+    def __init__(self):
+        self.postings = defaultdict(list)
+        self.size = 0
+
+    def register_document_indexes(self, index_document):
+        for doc_id, word, rank in index_document:
+            self.postings[word].append((doc_id, rank))
+            self.size += 1
+
+    def find_by_word(self, word, limit=None, max_rank=None):
+        hits = self.postings.get(word, ())
+        if max_rank is not None:
+            hits = [hit for hit in hits if hit[1] <= max_rank]
+        hits = sorted(hits, key=itemgetter(1), reverse=True)
+        return hits[:limit] if limit else hits
+
+    def find_ranks(self, word, document_ids):
+        """Ranks of word in given documents as dictionary"""
+        return {doc_id: rank for doc_id, rank in self.postings.get(word, ())
+                if doc_id in document_ids}
+
+    def frequencies(self):
+        """Document frequency of every word in delta"""
+        return {word: len(hits) for word, hits in self.postings.items()}
+
+    def clear(self):
+        self.postings.clear()
+        self.size = 0
+
+    def __iter__(self):
+        for word, hits in self.postings.items():
+            yield from ((doc_id, word, rank) for doc_id, rank in hits)
+
+    def __len__(self):
+        return self.size
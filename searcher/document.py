@@ -1,4 +1,5 @@
 from searcher import utils
+from searcher import compression
 from searcher.indexer import DocumentIndexer
 
 
@@ -6,15 +7,27 @@ class GenericDocument:
     """Representation of stored document. Can be queried for more information
     about this document and can be used to iterate over all words used in this
     document.
+
+    Content is stored as given by document store and decompressed lazily on
+    first access, so preview does not need to decode whole document.
     """
-    def __init__(self, document_id, content):
+    def __init__(self, document_id, content, codec='none'):
         self.document_id = document_id
-        self.content = content
+        self.codec = codec
+        self.__stored_content = content
+        self.__content = content if codec == 'none' else None
         self.__indexer = None
 
     def __iter__(self):
         yield from utils.iterate_words(self.content)
 
+    @property
+    def content(self):
+        if self.__content is None:
+            self.__content = compression.decompress(self.__stored_content,
+                                                    self.codec)
+        return self.__content
+
     @property
     def indexer(self):
         if self.__indexer is None:
@@ -23,4 +36,16 @@ class GenericDocument:
 
     @property
     def preview(self):
-        return self.content.split('\n', 1)[0]
+        if self.__content is not None:
+            return self.__content.split('\n', 1)[0]
+        return compression.decompress_prefix(self.__stored_content,
+                                             self.codec)
+
+    def head(self, length):
+        """First length characters of content, decompressing only as much
+        as needed
+        """
+        if self.__content is not None:
+            return self.__content[:length]
+        return compression.decompress_head(self.__stored_content,
+                                           self.codec, length)
@@ -0,0 +1,162 @@
+import re
+import sys
+from array import array
+from fnmatch import fnmatchcase
+from collections import Counter
+
+from searcher.terms import WILDCARDS
+from searcher.utils import encode_varint, decode_varint
+
+
+def trigrams(term):
+    padded = '${}$'.format(term)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def pattern_trigrams(pattern):
+    """Trigrams contained in every term matching wildcard pattern, taken
+    from its literal parts
+    """
+    if pattern[:1] not in WILDCARDS:
+        pattern = '$' + pattern
+    if pattern[-1:] not in WILDCARDS:
+        pattern += '$'
+    return {part[i:i + 3] for part in re.split(r'[*?]', pattern)
+            for i in range(len(part) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    """Levenshtein distance of a and b, or max_distance + 1 as soon as it is
+    clear distance is bigger than max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+class TrigramIndex:
+    """Character trigram index over vocabulary. Maps every trigram to ids
+    of terms containing it, so terms similar to misspelled word are found
+    without scanning whole vocabulary. Term id arrays are serialized as
+    they are in memory, so loading index copies them instead of decoding
+    every id.
+    """
+    def __init__(self):
+        self.terms = []
+        self.postings = dict()
+        self.lengths = None
+
+    @classmethod
+    def build(cls, terms):
+        index = cls()
+        index.add(terms)
+        return index
+
+    def add(self, terms):
+        """Index terms not indexed yet. They get ids after all existing
+        terms, so term id arrays stay sorted.
+        """
+        postings = self.postings
+        self.lengths = None
+        for term in terms:
+            term_id = len(self.terms)
+            self.terms.append(term)
+            for gram in trigrams(term):
+                postings.setdefault(gram, array('I')).append(term_id)
+
+    def candidates(self, word, max_distance):
+        """Terms sharing enough trigrams with word to be within
+        max_distance edits. Every edit changes at most three trigrams, so
+        short words may share none with similar terms; all terms of
+        length within max_distance are candidates then.
+        """
+        grams = trigrams(word)
+        min_shared = len(grams) - 3 * max_distance
+        if min_shared <= 0:
+            return [term for length in range(len(word) - max_distance,
+                                             len(word) + max_distance + 1)
+                    for term in self.terms_of_length(length)]
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        return [self.terms[term_id] for term_id, count in shared.items()
+                if count >= min_shared]
+
+    def match(self, pattern):
+        """Terms matching wildcard pattern, found among terms containing
+        all trigrams of its literal parts. None when pattern has no
+        literal part long enough to have trigram.
+        """
+        grams = pattern_trigrams(pattern)
+        if not grams:
+            return None
+        postings = sorted((self.postings.get(gram, ()) for gram in grams),
+                          key=len)
+        term_ids = set(postings[0])
+        for ids in postings[1:]:
+            term_ids.intersection_update(ids)
+        return [self.terms[term_id] for term_id in sorted(term_ids)
+                if fnmatchcase(self.terms[term_id], pattern)]
+
+    def terms_of_length(self, length):
+        if self.lengths is None:
+            self.lengths = dict()
+            for term in self.terms:
+                self.lengths.setdefault(len(term), []).append(term)
+        return self.lengths.get(length, ())
+
+    def search(self, word, max_distance):
+        """(term, distance) pairs of terms within max_distance edits"""
+        matches = []
+        for term in self.candidates(word, max_distance):
+            distance = edit_distance(word, term, max_distance)
+            if distance <= max_distance:
+                matches.append((term, distance))
+        return sorted(matches, key=lambda match: (match[1], match[0]))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def to_bytes(self):
+        terms = '\n'.join(self.terms).encode('utf-8')
+        out = bytearray(encode_varint(len(terms)) + terms)
+        out += encode_varint(len(self.postings))
+        for gram, term_ids in self.postings.items():
+            gram = gram.encode('utf-8')
+            out += encode_varint(len(gram)) + gram
+            out += encode_varint(len(term_ids))
+            if sys.byteorder == 'big':
+                term_ids = array('I', term_ids)
+                term_ids.byteswap()
+            out += term_ids.tobytes()
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        index = cls()
+        data = memoryview(data)
+        length, position = decode_varint(data)
+        terms = bytes(data[position:position + length]).decode('utf-8')
+        index.terms = terms.split('\n') if terms else []
+        gram_count, position = decode_varint(data, position + length)
+        for _ in range(gram_count):
+            length, position = decode_varint(data, position)
+            gram = bytes(data[position:position + length]).decode('utf-8')
+            count, position = decode_varint(data, position + length)
+            term_ids = array('I')
+            size = count * term_ids.itemsize
+            term_ids.frombytes(data[position:position + size])
+            if sys.byteorder == 'big':
+                term_ids.byteswap()
+            index.postings[gram] = term_ids
+            position += size
+        return index
@@ -0,0 +1,68 @@
+import heapq
+from array import array
+from operator import itemgetter
+
+
+class ImpactQuantizer:
+    """Maps float ranks to small integer impacts. Ranks are term frequency
+    divided by document length, so they lie in (0, 1] and are scaled
+    linearly by 2 ** bits - 1 for whole index.
+
+    Ranking differs from float ranks in two ways: ranks closer than
+    1 / (2 ** bits - 1) may become equal, and every rank smaller than that
+    is raised to impact 1, so rare mentions in long documents weigh a bit
+    more. Sum of impacts of n terms differs from scaled sum of float ranks
+    by at most n / 2.
+    """
+    def __init__(self, bits):
+        if bits not in (8, 16):
+            raise ValueError('impacts can be quantized to 8 or 16 bits')
+        self.bits = bits
+        self.scale = 2 ** bits - 1
+
+    def quantize(self, rank):
+        return max(1, int(round(rank * self.scale)))
+
+    def dequantize(self, impact):
+        return impact / self.scale
+
+    def __call__(self, index_document):
+        quantize = self.quantize
+        yield from ((did, word, quantize(rank))
+                    for did, word, rank in index_document)
+
+
+def accumulate_impacts(query_parts, postings, limit, skip=()):
+    """Sum integer impacts of query terms per document. When document ids
+    are dense integers, scores are accumulated in array indexed by id
+    instead of dictionary. Returns (document id, score) pairs of best
+    limit documents, leaving out documents in skip.
+    """
+    hits = [postings[word] for word, _ in query_parts]
+    doc_ids = [doc_id for word_hits in hits for doc_id, _ in word_hits]
+    if not doc_ids:
+        return []
+    dense = all(isinstance(doc_id, int) for doc_id in doc_ids)
+    if dense:
+        low, high = min(doc_ids), max(doc_ids)
+        dense = high - low < 4 * len(doc_ids)
+
+    if dense:
+        scores = array('q', bytes(8 * (high - low + 1)))
+        for word_hits in hits:
+            for doc_id, impact in word_hits:
+                scores[doc_id - low] += impact
+        results = ((position + low, score)
+                   for position, score in enumerate(scores) if score)
+    else:
+        scores = dict()
+        for word_hits in hits:
+            for doc_id, impact in word_hits:
+                scores[doc_id] = scores.get(doc_id, 0) + impact
+        results = scores.items()
+    if skip:
+        results = ((doc_id, score) for doc_id, score in results
+                   if doc_id not in skip)
+    if limit:
+        return heapq.nlargest(limit, results, key=itemgetter(1))
+    return sorted(results, key=itemgetter(1), reverse=True)
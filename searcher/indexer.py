@@ -8,7 +8,10 @@ class DocumentIndexer:
         self.index = Counter()
 
     def index_document(self):
-        for word in self.document:
+        self.index_words(self.document)
+
+    def index_words(self, words):
+        for word in words:
             self.index[word] += 1
             self.total_word_count += 1
 
@@ -0,0 +1,166 @@
+import re
+import json
+import zlib
+import base64
+
+
+TITLE = re.compile(r'^(?P<title>.*?)\s*\((?P<year>\d{4}|\?{4})(/[IVXL]+)?\)'
+                   r'(?P<rest>.*)$')
+KINDS = (('(TV)', 'tv'), ('(VG)', 'game'), ('(V)', 'video'))
+FILTER = re.compile(r'^(year|type):(\S+)$')
+FIELDS = ('year', 'type')
+
+
+def parse_title(line):
+    """Title, year and type of IMDB title line. Quoted titles are series,
+    or their episodes when followed by {episode name}.
+    """
+    line = line.strip()
+    match = TITLE.match(line)
+    if match is None:
+        return {'title': line, 'year': None, 'type': None}
+    title, year, rest = match.group('title', 'year', 'rest')
+    year = int(year) if year.isdigit() else None
+    if title.startswith('"') and title.endswith('"'):
+        kind = 'episode' if '{' in rest else 'series'
+        title = title[1:-1]
+    else:
+        kind = next((kind for marker, kind in KINDS if marker in rest),
+                    'movie')
+    return {'title': title, 'year': year, 'type': kind}
+
+
+def parse_filter(token):
+    """(field, predicate) of query token like year:1970..1979, year:1972,
+    year:..1950 or type:episode,series. None when token is not filter.
+    """
+    match = FILTER.match(token)
+    if match is None:
+        return None
+    field, value = match.groups()
+    if field == 'type':
+        kinds = set(value.lower().split(','))
+        return field, kinds.__contains__
+
+    low, separator, high = value.partition('..')
+    if not separator:
+        high = low
+    try:
+        low = int(low) if low else None
+        high = int(high) if high else None
+    except ValueError:
+        raise ValueError('invalid filter {!r}, use year:1970..1979'
+                         .format(token))
+    return field, lambda year: ((low is None or year >= low) and
+                                (high is None or year <= high))
+
+
+class Bitmap:
+    """Set of document ordinals stored as array of bits. Stored zlib
+    compressed, so long runs of unset bits take almost no space.
+    """
+    def __init__(self, data=b''):
+        self.bits = bytearray(data)
+
+    def add(self, ordinal):
+        byte = ordinal >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (ordinal & 7)
+
+    def __contains__(self, ordinal):
+        byte = ordinal >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] &
+                                              1 << (ordinal & 7))
+
+    def combine(self, other, operator):
+        size = max(len(self.bits), len(other.bits))
+        value = operator(int.from_bytes(self.bits, 'little'),
+                         int.from_bytes(other.bits, 'little'))
+        return Bitmap(value.to_bytes(size, 'little'))
+
+    def __or__(self, other):
+        return self.combine(other, int.__or__)
+
+    def __and__(self, other):
+        return self.combine(other, int.__and__)
+
+    def __iter__(self):
+        for byte, value in enumerate(self.bits):
+            if value:
+                yield from (byte * 8 + bit for bit in range(8)
+                            if value & 1 << bit)
+
+    def __len__(self):
+        return bin(int.from_bytes(self.bits, 'little')).count('1')
+
+    def to_bytes(self):
+        return zlib.compress(bytes(self.bits))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(zlib.decompress(data))
+
+
+class MetadataIndex:
+    """Bitmap of documents for every year and type. Integer document ids
+    are used as bit positions directly, other ids get ordinals in order
+    they were added.
+    """
+    def __init__(self):
+        self.bitmaps = {field: dict() for field in FIELDS}
+        self.document_ids = []
+        self.ordinals = dict()
+
+    def ordinal(self, document_id, create=False):
+        if isinstance(document_id, int):
+            return document_id
+        document_id = str(document_id)
+        ordinal = self.ordinals.get(document_id)
+        if ordinal is None and create:
+            ordinal = self.ordinals[document_id] = len(self.document_ids)
+            self.document_ids.append(document_id)
+        return ordinal
+
+    def add(self, document_id, metadata):
+        ordinal = self.ordinal(document_id, create=True)
+        for field in FIELDS:
+            value = metadata.get(field)
+            if value is not None:
+                self.bitmaps[field].setdefault(value, Bitmap()).add(ordinal)
+
+    def select(self, filters):
+        """Bitmap of documents matching all (field, predicate) filters"""
+        selected = None
+        for field, predicate in filters:
+            matching = Bitmap()
+            for value, bitmap in self.bitmaps[field].items():
+                if predicate(value):
+                    matching = matching | bitmap
+            selected = matching if selected is None else selected & matching
+        return selected
+
+    def allows(self, selected, document_id):
+        ordinal = self.ordinal(document_id)
+        return ordinal is not None and ordinal in selected
+
+    def to_bytes(self):
+        bitmaps = {field: [[value, base64.b64encode(bitmap.to_bytes())
+                            .decode('ascii')]
+                           for value, bitmap in values.items()]
+                   for field, values in self.bitmaps.items()}
+        data = {'document_ids': self.document_ids, 'bitmaps': bitmaps}
+        return json.dumps(data).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = json.loads(bytes(data).decode('utf-8'))
+        index = cls()
+        index.document_ids = data['document_ids']
+        index.ordinals = {document_id: ordinal for ordinal, document_id
+                          in enumerate(index.document_ids)}
+        for field, values in data['bitmaps'].items():
+            index.bitmaps[field] = {
+                value: Bitmap.from_bytes(base64.b64decode(bitmap))
+                for value, bitmap in values}
+        return index
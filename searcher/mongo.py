@@ -1,37 +1,71 @@
 import os
 from os.path import expanduser, abspath
 import sys
+from itertools import islice
+from collections import defaultdict
 from bson.objectid import ObjectId
 from plumbum import local
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import ExecutionTimeout
 
+from searcher.compression import compress, decompress, check_codec
 from searcher.controll import Controller
+from searcher.deadline import DeadlineExceeded
 from searcher.document import GenericDocument
+from searcher.stats import Stats
+
+
+BLOB_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def save_blob(blobs, name, data):
+    """Store binary data split into chunks fitting into documents"""
+    blobs.delete_many({'name': name})
+    chunks = [{'name': name, 'chunk': number,
+               'data': data[start:start + BLOB_CHUNK_SIZE]}
+              for number, start in enumerate(range(0, len(data),
+                                                   BLOB_CHUNK_SIZE))]
+    if chunks:
+        blobs.insert_many(chunks)
+
+
+def load_blob(blobs, name):
+    chunks = blobs.find({'name': name}).sort('chunk', 1)
+    data = b''.join(chunk['data'] for chunk in chunks)
+    return data or None
 
 
 class MongoController(Controller):
     def __init__(self, config):
+        super().__init__(config)
         self.__document_store = None
         self.__index_store = None
-        self.config = config
         host, port = config.get('mongo', 'host'), config.get('mongo', 'port')
         self.dbpath = 'mongodb://{}:{}'.format(host, port)
         self.db = MongoClient(self.dbpath)
         dbss = config.get('mongo', 'document_batch_store_size')
         self.document_batch_store_size = int(dbss)
+        dbls = config.get('mongo', 'document_batch_load_size',
+                          fallback='1000')
+        self.document_batch_load_size = int(dbls)
+        codec = config.get('mongo', 'compression', fallback='none')
+        self.document_codec = check_codec(codec)
+        self.term_lookup = config.get('mongo', 'term_lookup',
+                                      fallback='threads')
 
     @property
     def document_store(self):
         if self.__document_store is None:
             dbname = self.config.get('mongo', 'dbname')
-            self.__document_store = MongoDocumentStore(self.db, dbname)
+            self.__document_store = MongoDocumentStore(self.db, dbname,
+                                                       self.document_codec)
         return self.__document_store
 
     @property
     def index_store(self):
         if self.__index_store is None:
             dbname = self.config.get('mongo', 'dbname')
-            self.__index_store = MongoIndexStore(self.db, dbname)
+            self.__index_store = MongoIndexStore(self.db, dbname, self.stats)
         return self.__index_store
 
     def init(self, component, force):
@@ -44,12 +78,24 @@ class MongoController(Controller):
             self.document_store.clear()
         if component in ['indexes', 'all']:
             self.index_store.clear()
+        self.forget_caches()
 
-    def index(self, use_spark=False):
+    def index(self, use_spark=False, resume=False):
         if use_spark:
-            self.index_spark()
+            postings = self.index_spark()
         else:
-            super().index()
+            postings = super().index(resume)
+        if self.prune_top_n or self.prune_threshold:
+            self.prune()
+        return postings
+
+    def fetch_postings(self, words, limit=None, deadline=None):
+        if self.term_lookup == 'in':
+            try:
+                return self.index_store.find_by_words(words, limit, deadline)
+            except DeadlineExceeded:
+                return dict()
+        return super().fetch_postings(words, limit, deadline)
 
     def prepare_spark_cmd(self):
         spark_root = self.config.get('mongo', 'spark', fallback='')
@@ -59,6 +105,7 @@ class MongoController(Controller):
         return local[cmd]['--jars', mongo_jar]
 
     def index_spark(self):
+        self.save_impact_bits(self.quantization)
         os.putenv('PYSPARK_PYTHON', sys.executable)
         spark_indexer = local.which('spark-indexer.py')
         spark = self.prepare_spark_cmd()
@@ -66,24 +113,96 @@ class MongoController(Controller):
         spark(str(spark_indexer))
         print('indexed all documents from datastore')
         self.index_store.optimize_datastore()
+        self.rebuild_term_dictionary()
 
 
 class MongoDocumentStore:
-    def __init__(self, mongoclient, dbname):
+    def __init__(self, mongoclient, dbname, codec='none'):
         self.db = mongoclient
         self.dbname = dbname
+        self.codec = codec
+        self.hash_index_created = False
 
-    def prepare_document_query(self, content):
-        return {'content': content}
+    def prepare_document_query(self, content, content_hash=None):
+        return {'content': compress(content, self.codec), 'codec': self.codec,
+                'content_hash': content_hash}
 
     def store_documents(self, contents):
+        if not contents:
+            return []
+        documents = self.db[self.dbname].documents
+        inserted = documents.insert_many(contents).inserted_ids
+        return [str(did) for did in inserted]
+
+    def find_hashes(self, hashes):
+        """Return subset of content hashes already present in store"""
         documents = self.db[self.dbname].documents
-        documents.insert_many(contents)
+        if not self.hash_index_created:
+            documents.create_index('content_hash')
+            self.hash_index_created = True
+        query = {'content_hash': {'$in': list(hashes)}}
+        return {res['content_hash'] for res in
+                documents.find(query, projection={'content_hash': 1})}
+
+    def delete_documents(self, document_ids):
+        """Remove documents and remember their ids as tombstones until
+        their indexes are purged
+        """
+        db = self.db[self.dbname]
+        document_ids = [ObjectId(did) for did in document_ids]
+        query = {'_id': {'$in': document_ids}}
+        found = db.documents.find(query, projection={})
+        deleted = [res['_id'] for res in found]
+        if deleted:
+            db.documents.delete_many({'_id': {'$in': deleted}})
+            tombstone = {'$setOnInsert': {'deleted': True}}
+            db.tombstones.bulk_write([
+                UpdateOne({'_id': did}, tombstone, upsert=True)
+                for did in deleted])
+        return [str(did) for did in deleted]
+
+    def tombstones(self):
+        tombstones = self.db[self.dbname].tombstones
+        return {str(res['_id']) for res in tombstones.find(projection={})}
+
+    def clear_tombstones(self, document_ids):
+        document_ids = [ObjectId(did) for did in document_ids]
+        self.db[self.dbname].tombstones.delete_many(
+            {'_id': {'$in': document_ids}})
 
     def load_document(self, document_id):
         documents = self.db[self.dbname].documents
         document = documents.find_one({'_id': ObjectId(document_id)})
-        return GenericDocument(document_id, document['content'])
+        return GenericDocument(document_id, document['content'],
+                               document.get('codec', 'none'))
+
+    def load_documents(self, document_ids):
+        """Load documents using single query, in order of given ids.
+        Missing documents are skipped.
+        """
+        document_ids = [str(did) for did in document_ids]
+        query = {'_id': {'$in': [ObjectId(did) for did in document_ids]}}
+        found = {str(res['_id']): GenericDocument(str(res['_id']),
+                                                  res['content'],
+                                                  res.get('codec', 'none'))
+                 for res in self.db[self.dbname].documents.find(query)}
+        return [found[did] for did in document_ids if did in found]
+
+    def iter_documents(self, batch_size=1000, after=None):
+        """Yield lists of (id, content) pairs read using single cursor
+        ordered by id, starting after document id when given
+        """
+        documents = self.db[self.dbname].documents
+        query = {'_id': {'$gt': ObjectId(after)}} if after else {}
+        cursor = documents.find(query, projection={'content': 1, 'codec': 1},
+                                batch_size=batch_size).sort('_id', 1)
+        while True:
+            batch = [(res['_id'], decompress(res['content'],
+                                             res.get('codec', 'none')))
+                     for res in islice(cursor, batch_size)]
+            if not batch:
+                break
+            yield batch
 
     def __iter__(self):
         documents = self.db[self.dbname].documents
@@ -95,14 +214,25 @@ class MongoDocumentStore:
         if 'documents' in collections:
             print('WARNING: documents database already exists, droping')
             db.documents.drop()
+        if 'tombstones' in collections:
+            db.tombstones.drop()
+        if 'document_blobs' in collections:
+            db.document_blobs.drop()
+
+    def save_blob(self, name, data):
+        save_blob(self.db[self.dbname].document_blobs, name, data)
+
+    def load_blob(self, name):
+        return load_blob(self.db[self.dbname].document_blobs, name)
 
     def __len__(self):
         return self.db[self.dbname].documents.count()
 
 
 class MongoIndexStore:
-    def __init__(self, mongoclient, dbname):
+    def __init__(self, mongoclient, dbname, stats=None):
         self.db = mongoclient
+        self.stats = stats or Stats()
         self.max_query_length = 30000
         self.unsaved_indexes = []
         self.dbname = dbname
@@ -118,7 +248,30 @@ class MongoIndexStore:
     def store_indexes(self, indexes=None):
         if indexes is None:
             self.unsaved_indexes, indexes = [], self.unsaved_indexes
-        self.db[self.dbname].indexes_raw.insert_many(indexes)
+        if not indexes:
+            return
+        with self.stats.timer('index.write'):
+            self.db[self.dbname].indexes_raw.insert_many(indexes)
+
+    def begin(self, checkpoint=None):
+        """Prepare index run. Raw hits left by interrupted run are dropped,
+        or with checkpoint only hits of documents after it are removed.
+        """
+        indexes_raw = self.db[self.dbname].indexes_raw
+        self.unsaved_indexes = []
+        if checkpoint is None:
+            indexes_raw.drop()
+        else:
+            after = ObjectId(checkpoint['document'])
+            indexes_raw.delete_many({'hit.document': {'$gt': after}})
+
+    def check_impact_bits(self, bits):
+        """Hits store ranks of any type, so any impacts can be saved"""
+
+    def checkpoint(self):
+        """Write buffered hits to indexes_raw collection"""
+        self.store_indexes()
+        return {}
 
     def flush(self):
         self.store_indexes(self.unsaved_indexes)
@@ -126,7 +279,10 @@ class MongoIndexStore:
         self.optimize_datastore()
 
     def optimize_datastore(self):
-        print('optimizing datastore...', end='\r')
+        with self.stats.timer('index.optimize'):
+            self.aggregate_indexes()
+
+    def aggregate_indexes(self):
         indexes_raw = self.db[self.dbname].indexes_raw
         pipeline = [
             {'$sort': {'hit.rank': -1}},
@@ -135,20 +291,156 @@ class MongoIndexStore:
             {'$out': 'indexes'}, ]
         indexes_raw.aggregate(pipeline, allowDiskUse=True, useCursor=False)
         indexes_raw.drop()
-        print('datastore optimization done')
 
-    def find_by_word(self, word, limit=None):
+    def merge_indexes(self, indexes):
+        """Push (document id, word, rank) triples into aggregated hits of
+        their words, keeping hits ordered by rank
+        """
+        hits = defaultdict(list)
+        for doc_id, word, rank in indexes:
+            hits[word].append({'document': ObjectId(doc_id), 'rank': rank})
+        requests = [UpdateOne({'_id': word},
+                              {'$push': {'hits': {'$each': word_hits,
+                                                  '$sort': {'rank': -1}}},
+                               '$setOnInsert': {'word': word}},
+                              upsert=True)
+                    for word, word_hits in hits.items()]
+        if requests:
+            with self.stats.timer('index.write'):
+                self.db[self.dbname].indexes.bulk_write(requests,
+                                                        ordered=False)
+
+    def iter_postings(self):
+        """Yield (word, hits) pairs of all words, hits ordered by rank"""
         indexes = self.db[self.dbname].indexes
-        if limit:
-            projection = {'hits': {'$slice': limit}, '_id': 0}
-        else:
-            projection = {'hits': 1, '_id': 0}
-        res = indexes.find_one({'_id': word}, projection=projection)
+        for res in indexes.find(batch_size=100):
+            yield res['_id'], [(str(r['document']), r['rank'])
+                               for r in res['hits']]
+
+    def purge(self, document_ids):
+        """Remove all hits of documents"""
+        indexes = self.db[self.dbname].indexes
+        document_ids = [ObjectId(did) for did in document_ids]
+        with self.stats.timer('index.purge'):
+            indexes.update_many(
+                {'hits.document': {'$in': document_ids}},
+                {'$pull': {'hits': {'document': {'$in': document_ids}}}})
+            indexes.delete_many({'hits': {'$size': 0}})
+
+    def prune(self, top_n=None, threshold=None):
+        """Pull hits ranked below threshold and all but top_n hits of
+        every word. Hits are kept sorted by rank, so slicing keeps best.
+        """
+        indexes = self.db[self.dbname].indexes
+        if threshold:
+            indexes.update_many({}, {'$pull': {'hits': {'rank':
+                                                        {'$lt': threshold}}}})
+        if top_n:
+            indexes.update_many({}, {'$push': {'hits': {'$each': [],
+                                                        '$slice': top_n}}})
+        indexes.delete_many({'hits': {'$size': 0}})
+
+    def size(self):
+        """Number of hits and size of indexes collection in bytes"""
+        db = self.db[self.dbname]
+        pipeline = [{'$group': {'_id': None,
+                                'hits': {'$sum': {'$size': '$hits'}}}}]
+        result = list(db.indexes.aggregate(pipeline))
+        count = result[0]['hits'] if result else 0
+        return count, db.command('collstats', 'indexes')['size']
+
+    def term_frequencies(self):
+        pipeline = [{'$project': {'frequency': {'$size': '$hits'}}}]
+        indexes = self.db[self.dbname].indexes
+        yield from ((res['_id'], res['frequency'])
+                    for res in indexes.aggregate(pipeline, allowDiskUse=True))
+
+    def save_blob(self, name, data):
+        save_blob(self.db[self.dbname].blobs, name, data)
+
+    def delete_blob(self, name):
+        self.db[self.dbname].blobs.delete_many({'name': name})
+
+    def load_blob(self, name):
+        return load_blob(self.db[self.dbname].blobs, name)
+
+    def find_by_word(self, word, limit=None, max_rank=None, deadline=None):
+        """Hits of word ordered by rank. With deadline, server stops lookup
+        when it passes and DeadlineExceeded is raised.
+        """
+        indexes = self.db[self.dbname].indexes
+        if max_rank is not None:
+            yield from self.find_hits(word, {'$lte': ['$$hit.rank', max_rank]},
+                                      limit, deadline)
+            return
+        projection = self.hits_projection(limit)
+        try:
+            res = indexes.find_one({'_id': word}, projection=projection,
+                                   **self.time_limit(deadline))
+        except ExecutionTimeout:
+            raise DeadlineExceeded(word)
         if res:
             yield from ((str(r['document']), r['rank']) for r in res['hits'])
         else:
             return []
 
+    def time_limit(self, deadline, option='max_time_ms'):
+        """Options of lookup bounding its run time by deadline"""
+        if deadline is None:
+            return {}
+        if deadline.expired:
+            raise DeadlineExceeded()
+        return {option: deadline.remaining_ms()}
+
+    def find_ranks(self, word, document_ids):
+        """Ranks of word in given documents as dictionary"""
+        document_ids = [ObjectId(did) for did in document_ids]
+        condition = {'$in': ['$$hit.document', document_ids]}
+        return dict(self.find_hits(word, condition))
+
+    def find_hits(self, word, condition, limit=None, deadline=None):
+        """Hits of word matching aggregation condition on $$hit, filtered
+        on server so only matching part of hits array is transferred
+        """
+        hits = {'$filter': {'input': '$hits', 'as': 'hit',
+                            'cond': condition}}
+        if limit:
+            hits = {'$slice': [hits, limit]}
+        pipeline = [{'$match': {'_id': word}},
+                    {'$project': {'_id': 0, 'hits': hits}}]
+        options = self.time_limit(deadline, 'maxTimeMS')
+        try:
+            results = list(self.db[self.dbname].indexes.aggregate(pipeline,
+                                                                  **options))
+        except ExecutionTimeout:
+            raise DeadlineExceeded(word)
+        for res in results:
+            yield from ((str(r['document']), r['rank']) for r in res['hits'])
+
+    def find_by_words(self, words, limit=None, deadline=None):
+        """Fetch hits of all words using single $in lookup, stopped by
+        server when deadline passes
+        """
+        indexes = self.db[self.dbname].indexes
+        found = {word: [] for word in words}
+        projection = self.hits_projection(limit)
+        projection['_id'] = 1
+        query = {'_id': {'$in': list(found)}}
+        cursor = indexes.find(query, projection=projection,
+                              **self.time_limit(deadline))
+        try:
+            for res in cursor:
+                found[res['_id']] = [(str(r['document']), r['rank'])
+                                     for r in res['hits']]
+        except ExecutionTimeout:
+            raise DeadlineExceeded()
+        return found
+
+    def hits_projection(self, limit=None):
+        if limit:
+            return {'hits': {'$slice': limit}, '_id': 0}
+        return {'hits': 1, '_id': 0}
+
     def clear(self):
         db = self.db[self.dbname]
         collections = db.collection_names()
@@ -157,3 +449,5 @@ class MongoIndexStore:
             db.indexes.drop()
         if 'indexes_raw' in collections:
             db.indexes_raw.drop()
+        if 'blobs' in collections:
+            db.blobs.drop()
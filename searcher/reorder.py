@@ -0,0 +1,49 @@
+from searcher.dedup import MinHash
+from searcher.metadata import parse_title
+from searcher.utils import encode_varint
+
+
+ORDERS = ('title', 'terms')
+
+
+def title_key(content):
+    """Sort key grouping episodes of series and releases of same title"""
+    line = content.split('\n', 1)[0]
+    metadata = parse_title(line)
+    return metadata['title'].lower(), metadata['year'] or 0, line
+
+
+def terms_key(minhash):
+    """Sort key of MinHash signature over document terms. Documents with
+    same smallest term hashes, likely sharing rare terms, end up next to
+    each other.
+    """
+    return minhash.signature
+
+
+def document_order(documents, by='title'):
+    """Ids of (id, content) pairs in new order"""
+    if by == 'title':
+        key = title_key
+    elif by == 'terms':
+        key = terms_key(MinHash(num_perm=4, shingle_size=1))
+    else:
+        raise ValueError('documents can be ordered by {}'.format(
+            ', '.join(ORDERS)))
+    keys = [(key(content), document_id) for document_id, content in documents]
+    keys.sort(key=lambda pair: pair[0])
+    return [document_id for _, document_id in keys]
+
+
+def posting_gap_bytes(postings, ordinals):
+    """Bytes needed by document numbers of all posting lists, when they are
+    sorted and stored as varint encoded gaps
+    """
+    size = 0
+    for _, hits in postings:
+        previous = 0
+        for ordinal in sorted(ordinals[str(doc_id)] for doc_id, _ in hits
+                              if str(doc_id) in ordinals):
+            size += len(encode_varint(ordinal - previous))
+            previous = ordinal
+    return size
@@ -0,0 +1,71 @@
+import re
+
+from searcher.utils import stem_word
+
+
+WORD = re.compile(r'\w+')
+HIGHLIGHT = '**{}**'
+
+
+def find_matches(tokens, terms):
+    """(token position, term) pairs of tokens stemming to query terms.
+    Stemming keeps first two characters of words, so only tokens sharing
+    them with some term are stemmed at all.
+    """
+    prefixes = {term[:2] for term in terms}
+    stems, matches = dict(), []
+    for position, token in enumerate(tokens):
+        word = token.group(0).lower()
+        if word[:2] not in prefixes:
+            continue
+        if word not in stems:
+            stems[word] = stem_word(word)
+        if stems[word] in terms:
+            matches.append((position, stems[word]))
+    return matches
+
+
+def best_window(matches, length):
+    """Position of first match of window of length tokens covering most
+    distinct terms, and then most term occurrences
+    """
+    best, best_score, end = 0, (0, 0), 0
+    for first, (position, _) in enumerate(matches):
+        while end < len(matches) and matches[end][0] < position + length:
+            end += 1
+        window = matches[first:end]
+        score = (len({term for _, term in window}), len(window))
+        if score > best_score:
+            best, best_score = position, score
+    return best
+
+
+def make_snippet(text, terms, length=30, context=5):
+    """Passage of length words of text containing most of query terms,
+    starting context words before first of them, with terms highlighted.
+    Text is expected to be bounded head of document.
+    """
+    tokens = list(WORD.finditer(text))
+    if not tokens:
+        return ''
+    matches = find_matches(tokens, set(terms))
+    context = min(context, length // 2)
+    start = best_window(matches, length - context) - context
+    start = max(0, min(start, len(tokens) - length))
+    end = min(start + length, len(tokens))
+
+    highlighted = {position for position, _ in matches}
+    parts = []
+    for position in range(start, end):
+        token = tokens[position]
+        if position > start:
+            parts.append(text[tokens[position - 1].end():token.start()])
+        word = token.group(0)
+        parts.append(HIGHLIGHT.format(word) if position in highlighted
+                     else word)
+    snippet = ' '.join(''.join(parts).split())
+    if start > 0:
+        snippet = '... ' + snippet
+    if end < len(tokens):
+        snippet += ' ...'
+    return snippet
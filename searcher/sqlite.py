@@ -1,66 +1,190 @@
 import os
 import csv
 import sqlite3
+import threading
+from operator import itemgetter
+from itertools import groupby
 
+from searcher.compression import compress, decompress, check_codec
 from searcher.controll import Controller
+from searcher.deadline import DeadlineExceeded
 from searcher.document import GenericDocument
+from searcher.stats import Stats
+
+
+BLOBS_TABLE = 'CREATE TABLE IF NOT EXISTS blobs(' \
+              'name TEXT PRIMARY KEY NOT NULL, ' \
+              'data BLOB NOT NULL);'
+TOMBSTONES_TABLE = 'CREATE TABLE IF NOT EXISTS tombstones(' \
+                   'document_id INTEGER PRIMARY KEY NOT NULL);'
+
+
+def chunked_in(db, query, values, size=500, params=()):
+    """Execute query containing 'IN ({})' for chunks of values, keeping
+    number of parameters under SQLite limit. Params are bound before
+    values.
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        chunk = values[start:start + size]
+        placeholders = ', '.join('?' * len(chunk))
+        yield from db.execute(query.format(placeholders),
+                              list(params) + chunk)
 
 
 class SQLiteController(Controller):
     def __init__(self, config):
+        super().__init__(config)
         self.__document_store = None
         self.__index_store = None
-        self.config = config
         self.document_connector = config.get('sqlite3', 'documents')
         dbss = config.get('sqlite3', 'document_batch_store_size')
         self.document_batch_store_size = int(dbss)
+        dbls = config.get('sqlite3', 'document_batch_load_size',
+                          fallback='1000')
+        self.document_batch_load_size = int(dbls)
+        codec = config.get('sqlite3', 'compression', fallback='none')
+        self.document_codec = check_codec(codec)
         self.index_connector = config.get('sqlite3', 'indexes')
 
     @property
     def document_store(self):
         if self.__document_store is None:
-            self.__document_store = SQLiteDocumentStore(self.document_connector)
+            self.__document_store = SQLiteDocumentStore(
+                self.document_connector, self.document_codec)
         return self.__document_store
 
     @property
     def index_store(self):
         if self.__index_store is None:
-            self.__index_store = SQLiteIndexStore(self.index_connector)
+            self.__index_store = SQLiteIndexStore(self.index_connector,
+                                                  self.stats,
+                                                  self.quantization)
         return self.__index_store
 
-    def index(self, use_spark=False):
+    def index(self, use_spark=False, resume=False):
         if use_spark:
             print('Can\'t use spark with SQLite datastores')
         else:
-            super().index()
+            return super().index(resume)
 
 
 class SQLiteDocumentStore:
-    def __init__(self, dbpath):
+    def __init__(self, dbpath, codec='none'):
         self.dbpath = dbpath
+        self.codec = codec
         self.__db = None
 
     @property
     def db(self):
         if self.__db is None:
             self.__db = sqlite3.connect(self.dbpath)
+            self.migrate(self.__db)
         return self.__db
 
+    def migrate(self, db):
+        """Add columns and tables missing in documents store created by
+        older version, so existing stores stay readable
+        """
+        columns = {row[1] for row
+                   in db.execute('PRAGMA table_info(documents)')}
+        if not columns:
+            return
+        if 'codec' not in columns:
+            db.execute('ALTER TABLE documents ADD COLUMN '
+                       'codec TEXT NOT NULL DEFAULT \'none\'')
+        if 'content_hash' not in columns:
+            db.execute('ALTER TABLE documents ADD COLUMN '
+                       'content_hash CHAR(32)')
+        db.execute('CREATE INDEX IF NOT EXISTS documents_content_hash_idx '
+                   'ON documents (content_hash)')
+        db.execute(TOMBSTONES_TABLE)
+        db.commit()
+
     def load_document(self, document_id):
         cur = self.db.cursor()
-        query = 'SELECT content FROM documents WHERE id=?'
+        query = 'SELECT content, codec FROM documents WHERE id=?'
         result = cur.execute(query, (document_id, )).fetchone()
-        return GenericDocument(document_id, result[0])
+        return GenericDocument(document_id, result[0], result[1])
+
+    def load_documents(self, document_ids):
+        """Load documents using single query, in order of given ids.
+        Missing documents are skipped.
+        """
+        document_ids = [int(did) for did in document_ids]
+        query = 'SELECT id, content, codec FROM documents WHERE id IN ({})'
+        found = {did: GenericDocument(did, content, codec)
+                 for did, content, codec in chunked_in(self.db, query,
+                                                       document_ids)}
+        return [found[did] for did in document_ids if did in found]
 
-    def prepare_document_query(self, content):
-        return (content, )
+    def prepare_document_query(self, content, content_hash=None):
+        return compress(content, self.codec), self.codec, content_hash
 
     def store_documents(self, contents):
+        """Insert documents in single transaction and return their ids.
+        Ids of one insert are consecutive, so they are derived from the
+        last one.
+        """
+        contents = list(contents)
+        if not contents:
+            return []
         cur = self.db.cursor()
-        query = 'INSERT INTO documents (content) VALUES (?)'
+        query = 'INSERT INTO documents (content, codec, content_hash) ' \
+                'VALUES (?, ?, ?)'
         cur.executemany(query, contents)
+        last = cur.execute('SELECT last_insert_rowid()').fetchone()[0]
+        self.db.commit()
+        return list(range(last - len(contents) + 1, last + 1))
+
+    def find_hashes(self, hashes):
+        """Return subset of content hashes already present in store"""
+        query = 'SELECT content_hash FROM documents ' \
+                'WHERE content_hash IN ({})'
+        return {r[0] for r in chunked_in(self.db, query, hashes)}
+
+    def delete_documents(self, document_ids):
+        """Remove documents and remember their ids as tombstones until
+        their indexes are purged
+        """
+        document_ids = [int(did) for did in document_ids]
+        query = 'SELECT id FROM documents WHERE id IN ({})'
+        deleted = [r[0] for r in chunked_in(self.db, query, document_ids)]
+        list(chunked_in(self.db, 'DELETE FROM documents WHERE id IN ({})',
+                        deleted))
+        self.db.execute(TOMBSTONES_TABLE)
+        self.db.executemany('INSERT OR IGNORE INTO tombstones (document_id) '
+                            'VALUES (?)', ((did, ) for did in deleted))
+        self.db.commit()
+        return deleted
+
+    def tombstones(self):
+        try:
+            result = self.db.execute('SELECT document_id FROM tombstones')
+        except sqlite3.OperationalError:
+            return set()
+        return {r[0] for r in result}
+
+    def clear_tombstones(self, document_ids):
+        query = 'DELETE FROM tombstones WHERE document_id IN ({})'
+        list(chunked_in(self.db, query, document_ids))
         self.db.commit()
 
+    def iter_documents(self, batch_size=1000, after=None):
+        """Yield lists of (id, content) pairs read using single cursor,
+        starting after document id when given
+        """
+        cur = self.db.cursor()
+        after = int(after) if after is not None else 0
+        cur.execute('SELECT id, content, codec FROM documents WHERE id > ? '
+                    'ORDER BY id', (after, ))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(did, decompress(content, codec))
+                   for did, content, codec in rows]
+
     def __iter__(self):
         cur = self.db.cursor()
         query = 'SELECT id FROM documents'
@@ -74,7 +198,26 @@ class SQLiteDocumentStore:
 
         self.db.execute('CREATE TABLE documents('
                         'id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
-                        'content TEXT NOT NULL);')
+                        'content TEXT NOT NULL, '
+                        'codec TEXT NOT NULL DEFAULT \'none\', '
+                        'content_hash CHAR(32));')
+        self.db.execute('CREATE INDEX documents_content_hash_idx '
+                        'ON documents (content_hash)')
+        self.db.execute(TOMBSTONES_TABLE)
+
+    def save_blob(self, name, data):
+        self.db.execute(BLOBS_TABLE)
+        self.db.execute('INSERT OR REPLACE INTO blobs (name, data) '
+                        'VALUES (?, ?)', (name, data))
+        self.db.commit()
+
+    def load_blob(self, name):
+        query = 'SELECT data FROM blobs WHERE name=?'
+        try:
+            result = self.db.execute(query, (name, )).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return result[0] if result else None
 
     def clear(self):
         if os.path.isfile(self.dbpath):
@@ -89,9 +232,12 @@ class SQLiteDocumentStore:
 
 
 class SQLiteIndexStore:
-    def __init__(self, dbpath):
+    def __init__(self, dbpath, stats=None, quantization=0):
         self.dbpath = dbpath
-        self.__db = None
+        self.stats = stats or Stats()
+        self.rank_type = 'INTEGER' if quantization else 'FLOAT'
+        self.__local = threading.local()
+        self.__connections = []
         self.unsaved_indexes = []
         self.max_query_length = 10000
         self.next_index_id = 1
@@ -100,9 +246,15 @@ class SQLiteIndexStore:
 
     @property
     def db(self):
-        if self.__db is None:
-            self.__db = sqlite3.connect(self.dbpath)
-        return self.__db
+        """Connection owned by calling thread, so words can be looked up
+        from query thread pool concurrently.
+        """
+        db = getattr(self.__local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.dbpath, check_same_thread=False)
+            self.__local.db = db
+            self.__connections.append(db)
+        return db
 
     def register_document_indexes(self, index_document):
         self.unsaved_indexes.extend(index_document)
@@ -118,14 +270,48 @@ class SQLiteIndexStore:
 
         if indexes is None:
             self.unsaved_indexes, indexes = [], self.unsaved_indexes
+        if not indexes:
+            return
 
         indexes = [(iid, did, w, r)
                    for iid, (did, w, r) in enumerate(indexes, self.next_index_id)]
         self.next_index_id = indexes[-1][0] + 1
 
-        with open(self.csv_buffer, 'a') as fp:
+        with self.stats.timer('index.write'), open(self.csv_buffer, 'a') as fp:
+            start = fp.tell()
             writer = csv.writer(fp)
             writer.writerows(indexes)
+            self.stats.incr('index.bytes_written', fp.tell() - start)
+
+    def begin(self, checkpoint=None):
+        """Prepare index run. With checkpoint, CSV buffer of interrupted
+        run is cut to its checkpointed size and appended to.
+        """
+        if checkpoint is None:
+            return
+        csv_size = checkpoint['csv_size']
+        if (not os.path.isfile(self.csv_buffer)
+                or os.path.getsize(self.csv_buffer) < csv_size):
+            raise ValueError('{} is missing or shorter than checkpointed {} '
+                             'bytes, cannot resume index run'
+                             .format(self.csv_buffer, csv_size))
+        with open(self.csv_buffer, 'a') as fp:
+            fp.truncate(csv_size)
+        self.next_index_id = checkpoint['next_index_id']
+        self.csv_buffer_created = True
+        self.unsaved_indexes = []
+
+    def checkpoint(self):
+        """Write buffered postings and sync CSV buffer to disk. Returns
+        state needed to continue writing it after crash.
+        """
+        self.store_indexes()
+        csv_size = 0
+        if os.path.isfile(self.csv_buffer):
+            with open(self.csv_buffer, 'a') as fp:
+                os.fsync(fp.fileno())
+            csv_size = os.path.getsize(self.csv_buffer)
+        return {'csv_size': csv_size, 'next_index_id': self.next_index_id}
 
     def flush(self):
         self.store_indexes(self.unsaved_indexes)
@@ -139,38 +325,153 @@ class SQLiteIndexStore:
         print(msg.format(self.csv_buffer))
         self.csv_buffer_created = False
 
-    def find_by_word(self, word, limit=None):
+    def merge_indexes(self, indexes):
+        """Insert (document id, word, rank) triples right into index
+        database, skipping csv buffer meant for full index builds
+        """
+        query = 'INSERT INTO indexes (document_id, word, rank) ' \
+                'VALUES (?, ?, ?)'
+        with self.stats.timer('index.write'):
+            self.db.executemany(query, indexes)
+            self.db.commit()
+
+    def iter_postings(self):
+        """Yield (word, hits) pairs of all words, hits ordered by rank"""
+        cur = self.db.cursor()
+        cur.execute('SELECT word, document_id, rank FROM indexes '
+                    'ORDER BY word, rank DESC')
+        for word, rows in groupby(cur, key=itemgetter(0)):
+            yield word, [(did, rank) for _, did, rank in rows]
+
+    def purge(self, document_ids):
+        """Remove all indexes of documents"""
+        query = 'DELETE FROM indexes WHERE document_id IN ({})'
+        with self.stats.timer('index.purge'):
+            list(chunked_in(self.db, query, document_ids))
+            self.db.commit()
+
+    def prune(self, top_n=None, threshold=None):
+        """Delete postings ranked below threshold and all but top_n
+        postings of every word
+        """
+        if threshold:
+            self.db.execute('DELETE FROM indexes WHERE rank < ?',
+                            (threshold, ))
+        if top_n:
+            self.db.execute('DELETE FROM indexes WHERE id IN ('
+                            'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+                            'PARTITION BY word ORDER BY rank DESC, '
+                            'document_id) AS position FROM indexes) '
+                            'WHERE position > ?)', (top_n, ))
+        self.db.commit()
+        self.db.execute('VACUUM')
+
+    def size(self):
+        """Number of postings and size of index database in bytes"""
+        count = self.db.execute('SELECT COUNT(*) FROM indexes').fetchone()[0]
+        return count, os.path.getsize(self.dbpath)
+
+    def term_frequencies(self):
+        query = 'SELECT word, COUNT(*) FROM indexes GROUP BY word'
+        yield from self.db.execute(query)
+
+    def save_blob(self, name, data):
+        self.db.execute(BLOBS_TABLE)
+        self.db.execute('INSERT OR REPLACE INTO blobs (name, data) '
+                        'VALUES (?, ?)', (name, data))
+        self.db.commit()
+
+    def delete_blob(self, name):
+        self.db.execute(BLOBS_TABLE)
+        self.db.execute('DELETE FROM blobs WHERE name=?', (name, ))
+        self.db.commit()
+
+    def load_blob(self, name):
+        query = 'SELECT data FROM blobs WHERE name=?'
+        try:
+            result = self.db.execute(query, (name, )).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return result[0] if result else None
+
+    def find_by_word(self, word, limit=None, max_rank=None, deadline=None):
+        """Hits of word ordered by rank, only those ranked at most max_rank
+        when given. Index on (word, rank) lets SQLite seek straight to it.
+        Lookup running when deadline passes is interrupted by progress
+        handler and DeadlineExceeded raised, so it does not hold query
+        worker any longer.
+        """
+        params = (word, )
+        q = 'SELECT document_id, rank FROM indexes WHERE word=? '
+        if max_rank is not None:
+            q += 'AND rank<=? '
+            params += (max_rank, )
+        q += 'ORDER BY rank DESC'
         if limit:
-            q = 'SELECT document_id, rank ' \
-                'FROM indexes ' \
-                'WHERE word=? ' \
-                'ORDER BY rank DESC ' \
-                'LIMIT {} '.format(limit)
-        else:
-            q = 'SELECT document_id, rank FROM indexes WHERE word=? ' \
-                'ORDER BY rank DESC'
+            q += ' LIMIT {}'.format(limit)
         cur = self.db.cursor()
-        yield from cur.execute(q, (word, ))
+        if deadline is None:
+            yield from cur.execute(q, params)
+            return
+
+        if deadline.expired:
+            raise DeadlineExceeded(word)
+        self.db.set_progress_handler(lambda: deadline.expired, 1000)
+        try:
+            hits = cur.execute(q, params).fetchall()
+        except sqlite3.OperationalError:
+            if deadline.expired:
+                raise DeadlineExceeded(word)
+            raise
+        finally:
+            self.db.set_progress_handler(None, 1000)
+        yield from hits
+
+    def check_impact_bits(self, bits):
+        """Refuse integer impacts when indexes table was created with float
+        rank column, which would turn them back into floats
+        """
+        columns = {row[1]: row[2] for row in
+                   self.db.execute('PRAGMA table_info(indexes)')}
+        if bits and columns.get('rank') == 'FLOAT':
+            raise ValueError('indexes table stores float ranks, run init '
+                             'indexes --force to store {}-bit impacts'
+                             .format(bits))
+
+    def find_ranks(self, word, document_ids):
+        """Ranks of word in given documents as dictionary"""
+        query = 'SELECT document_id, rank FROM indexes ' \
+                'WHERE word=? AND document_id IN ({})'
+        return dict(chunked_in(self.db, query, document_ids,
+                               params=(word, )))
 
     def init(self):
-        if os.path.isfile(self.dbpath):
+        """Create tables missing in index database. File holding only
+        blobs gets indexes table too.
+        """
+        tables = {row[0] for row in self.db.execute(
+            'SELECT name FROM sqlite_master WHERE type=\'table\'')}
+        if 'indexes' in tables:
             template = 'WARNING: {} already exist, won\'t overwrite'
             print(template.format(self.dbpath))
             return
 
-        self.db.execute('CREATE TABLE indexes('
+        self.db.execute('CREATE TABLE IF NOT EXISTS indexes('
                         'id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
                         'document_id INTEGER NOT NULL, '
                         'word CHAR(50) NOT NULL, '
-                        'rank FLOAT NOT NULL);')
-        self.db.execute('CREATE INDEX indexes_document_id_idx '
+                        'rank {} NOT NULL);'.format(self.rank_type))
+        self.db.execute('CREATE INDEX IF NOT EXISTS indexes_document_id_idx '
                         'ON indexes (document_id)')
-        self.db.execute('CREATE INDEX indexes_word_idx ON indexes (word)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS indexes_word_idx '
+                        'ON indexes (word, rank)')
+        self.db.execute(BLOBS_TABLE)
 
     def clear(self):
         if os.path.isfile(self.dbpath):
             print('WARNING: {} already exist, deleting'.format(self.dbpath))
-            if self.__db is not None:
-                self.__db.close()
+            for db in self.__connections:
+                db.close()
             os.remove(self.dbpath)
-            self.__db = None
+            self.__local = threading.local()
+            self.__connections = []
@@ -0,0 +1,60 @@
+import time
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+
+
+class Stats:
+    """Timers and counters collected around hot paths of controller. Stage
+    and counter names are prefixed by operation, e.g. 'index.tokenize'.
+    """
+    def __init__(self):
+        self.timers = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[stage] += time.perf_counter() - start
+            self.calls[stage] += 1
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, timing how long producing each item took"""
+        iterator = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def incr(self, counter, value=1):
+        self.counters[counter] += value
+
+    def reset(self):
+        self.timers.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def as_dict(self, prefix=''):
+        timers = {stage: {'seconds': seconds, 'calls': self.calls[stage]}
+                  for stage, seconds in self.timers.items()
+                  if stage.startswith(prefix)}
+        counters = {name: value for name, value in self.counters.items()
+                    if name.startswith(prefix)}
+        return {'timers': timers, 'counters': counters}
+
+    def report(self, prefix=''):
+        stats = self.as_dict(prefix)
+        lines = ['timers:']
+        for stage, timer in sorted(stats['timers'].items()):
+            lines.append('  {:<24} {:>10.3f}s {:>10} calls'.format(
+                stage, timer['seconds'], timer['calls']))
+        lines.append('counters:')
+        for name, value in sorted(stats['counters'].items()):
+            lines.append('  {:<24} {:>11}'.format(name, value))
+        return '\n'.join(lines)
@@ -0,0 +1,150 @@
+import heapq
+from bisect import bisect_right
+from fnmatch import fnmatchcase
+from operator import itemgetter
+from collections import Counter
+
+from searcher.utils import encode_varint, decode_varint
+
+
+WILDCARDS = '*?'
+
+
+def literal_prefix(pattern):
+    """Part of wildcard pattern before first wildcard character"""
+    for position, char in enumerate(pattern):
+        if char in WILDCARDS:
+            return pattern[:position]
+    return pattern
+
+
+def most_frequent(matches, max_expansions=None):
+    """(term, frequency) pairs ordered by frequency, only max_expansions
+    most frequent ones when given
+    """
+    if max_expansions:
+        return heapq.nlargest(max_expansions, matches, key=itemgetter(1))
+    return sorted(matches, key=itemgetter(1), reverse=True)
+
+
+class TermDictionary:
+    """Sorted vocabulary of index with document frequency of every term.
+    Terms are front coded in blocks: first term of block is stored whole,
+    following ones as length of prefix shared with previous term and rest
+    of the term. Only first terms of blocks are kept decoded for lookups.
+    """
+    def __init__(self, block_size=16):
+        self.block_size = block_size
+        self.first_terms = []
+        self.blocks = []
+        self.size = 0
+
+    @classmethod
+    def build(cls, frequencies, block_size=16):
+        """Build dictionary from mapping of term to document frequency"""
+        dictionary = cls(block_size)
+        terms = sorted(frequencies.items())
+        for start in range(0, len(terms), block_size):
+            block = terms[start:start + block_size]
+            dictionary.first_terms.append(block[0][0])
+            dictionary.blocks.append(cls.encode_block(block))
+        dictionary.size = len(terms)
+        return dictionary
+
+    @staticmethod
+    def encode_block(block):
+        out, previous = bytearray(), b''
+        for term, frequency in block:
+            term = term.encode('utf-8')
+            shared = 0
+            for a, b in zip(previous, term):
+                if a != b:
+                    break
+                shared += 1
+            suffix = term[shared:]
+            out += encode_varint(shared) + encode_varint(len(suffix))
+            out += suffix + encode_varint(frequency)
+            previous = term
+        return bytes(out)
+
+    @staticmethod
+    def decode_block(block):
+        position, previous = 0, b''
+        while position < len(block):
+            shared, position = decode_varint(block, position)
+            length, position = decode_varint(block, position)
+            term = previous[:shared] + block[position:position + length]
+            frequency, position = decode_varint(block, position + length)
+            previous = term
+            yield term.decode('utf-8'), frequency
+
+    def iter_from(self, prefix):
+        """Yield (term, frequency) pairs of terms >= prefix in order"""
+        start = max(bisect_right(self.first_terms, prefix) - 1, 0)
+        for block in self.blocks[start:]:
+            for term, frequency in self.decode_block(block):
+                if term >= prefix:
+                    yield term, frequency
+
+    def expand(self, pattern, max_expansions=None):
+        """Terms matching prefix or wildcard pattern with their document
+        frequencies. Only max_expansions most frequent terms are returned.
+        Pattern starting with wildcard would scan whole vocabulary and is
+        refused.
+        """
+        prefix = literal_prefix(pattern)
+        if not prefix:
+            raise ValueError('pattern {!r} starts with wildcard'
+                             .format(pattern))
+        is_wildcard = prefix != pattern
+        matches = []
+        for term, frequency in self.iter_from(prefix):
+            if not term.startswith(prefix):
+                break
+            if is_wildcard and not fnmatchcase(term, pattern):
+                continue
+            matches.append((term, frequency))
+        return most_frequent(matches, max_expansions)
+
+    def merged(self, frequencies):
+        """New dictionary with document frequencies added to these"""
+        merged = Counter(dict(self))
+        merged.update(frequencies)
+        return self.build(merged, self.block_size)
+
+    def frequency(self, term):
+        for candidate, frequency in self.iter_from(term):
+            return frequency if candidate == term else 0
+        return 0
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from self.decode_block(block)
+
+    def __len__(self):
+        return self.size
+
+    def to_bytes(self):
+        out = bytearray()
+        out += encode_varint(self.block_size) + encode_varint(self.size)
+        out += encode_varint(len(self.blocks))
+        for first_term, block in zip(self.first_terms, self.blocks):
+            first_term = first_term.encode('utf-8')
+            out += encode_varint(len(first_term)) + first_term
+            out += encode_varint(len(block)) + block
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        block_size, position = decode_varint(data)
+        dictionary = cls(block_size)
+        dictionary.size, position = decode_varint(data, position)
+        block_count, position = decode_varint(data, position)
+        for _ in range(block_count):
+            length, position = decode_varint(data, position)
+            first_term = data[position:position + length].decode('utf-8')
+            length, position = decode_varint(data, position + length)
+            dictionary.first_terms.append(first_term)
+            dictionary.blocks.append(bytes(data[position:position + length]))
+            position += length
+        return dictionary
@@ -28,3 +28,26 @@ def files_iterator(path):
 def document_count(path):
     return len(list(files_iterator(path)))
 
+
+def encode_varint(value):
+    """Encode non-negative integer using 7 bits per byte, high bit marks
+    that another byte follows
+    """
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(data, position=0):
+    """Decode varint starting at position. Returns (value, next position)"""
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
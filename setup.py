@@ -8,7 +8,8 @@ setup(
     author='Tomas Stibrany',
     author_email='tms.stibrany@gmail.com',
     url='https://github.com/tondzus/python-searcher',
-    scripts=['bin/imdb.py', 'bin/admin.py', 'bin/spark-indexer.py'],
+    scripts=['bin/imdb.py', 'bin/admin.py', 'bin/spark-indexer.py',
+             'bin/benchmark.py'],
     packages=['searcher'],
     package_data={'': ['conf.ini']},
     install_requires=['plumbum'],
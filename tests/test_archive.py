@@ -0,0 +1,46 @@
+import io
+import pytest
+from searcher.archive import ArchiveWriter, ArchiveReader, DOCUMENTS, \
+    POSTINGS, MAGIC
+
+
+def write_archive(impact_bits=0, chunk_size=16):
+    fp = io.BytesIO()
+    writer = ArchiveWriter(fp, impact_bits, chunk_size=chunk_size)
+    writer.add_document('a', 'first document')
+    writer.add_document('b', 'druhý dokument')
+    rank = 3 if impact_bits else 0.25
+    assert writer.add_postings('document', [('b', rank), ('a', rank),
+                                            ('deleted', rank)]) == 2
+    assert writer.add_postings('missing', [('deleted', rank)]) == 0
+    writer.close()
+    fp.seek(0)
+    return fp
+
+
+@pytest.mark.parametrize('impact_bits', [0, 8])
+def test_archive_roundtrip(impact_bits):
+    reader = ArchiveReader(write_archive(impact_bits))
+    rank = 3 if impact_bits else 0.25
+    assert list(reader) == [(DOCUMENTS, 'first document'),
+                            (DOCUMENTS, 'druhý dokument'),
+                            (POSTINGS, ('document', [(1, rank), (0, rank)]))]
+
+
+def test_archive_detects_corruption():
+    data = bytearray(write_archive().getvalue())
+    data[-20] ^= 0xff
+    with pytest.raises(ValueError):
+        list(ArchiveReader(io.BytesIO(bytes(data))))
+
+
+def test_archive_detects_truncation():
+    data = write_archive().getvalue()
+    with pytest.raises(ValueError):
+        list(ArchiveReader(io.BytesIO(data[:-10])))
+
+
+def test_archive_rejects_other_files():
+    with pytest.raises(ValueError):
+        ArchiveReader(io.BytesIO(b'not an archive'))
+    assert write_archive().getvalue().startswith(MAGIC)
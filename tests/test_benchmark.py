@@ -0,0 +1,47 @@
+import os
+import configparser
+from searcher import benchmark
+
+
+def test_generate_corpus_is_reproducible(tmpdir):
+    first = tmpdir.mkdir('first')
+    second = tmpdir.mkdir('second')
+    benchmark.generate_corpus(str(first), 5, seed=1, vocabulary_size=50)
+    benchmark.generate_corpus(str(second), 5, seed=1, vocabulary_size=50)
+    assert len(os.listdir(str(first))) == 5
+    for name in os.listdir(str(first)):
+        assert first.join(name).read() == second.join(name).read()
+
+
+def test_generate_queries_uses_vocabulary():
+    vocabulary = ['alpha', 'beta', 'gamma']
+    queries = benchmark.generate_queries(vocabulary, 10, max_terms=2)
+    assert len(queries) == 10
+    for query in queries:
+        assert 1 <= len(query.split()) <= 2
+        assert set(query.split()) <= set(vocabulary)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 0) == 1
+    assert benchmark.percentile(values, 50) == 50.5
+    assert benchmark.percentile(values, 100) == 100
+    assert benchmark.percentile([], 50) == 0.0
+
+
+def test_run_benchmark_sqlite(tmpdir):
+    corpus = str(tmpdir.join('corpus'))
+    vocabulary = benchmark.generate_corpus(corpus, 20, vocabulary_size=100)
+    queries = benchmark.generate_queries(vocabulary, 5)
+    config = configparser.ConfigParser()
+    config['default'] = {'datastore': 'sqlite3', 'query_limit': 10}
+    config['sqlite3'] = {'document_batch_store_size': 100}
+    config = benchmark.benchmark_config(config, 'sqlite3', str(tmpdir))
+
+    result = benchmark.run_benchmark(config, corpus, 20, queries, str(tmpdir))
+    assert result['backend'] == 'sqlite3'
+    assert result['register']['documents'] == 20
+    assert result['index']['postings'] > 0
+    assert result['query']['queries'] == 5
+    assert result['query']['p50_ms'] <= result['query']['p99_ms']
@@ -0,0 +1,45 @@
+import pytest
+from searcher import compression
+
+
+TEXT = '"Doctor in Charge" (1972) {The Minister\'s Health (#1.3)}\n' \
+       '  PL: The Minister of Health is to be admitted. ' * 20
+
+
+@pytest.mark.parametrize('codec', compression.CODECS)
+def test_compress_roundtrip(codec):
+    data = compression.compress(TEXT, codec)
+    assert compression.decompress(data, codec) == TEXT
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def test_compress_shrinks_content(codec):
+    data = compression.compress(TEXT, codec)
+    assert isinstance(data, bytes)
+    assert len(data) < len(TEXT)
+
+
+@pytest.mark.parametrize('codec', compression.CODECS)
+def test_decompress_prefix(codec):
+    data = compression.compress(TEXT, codec)
+    prefix = compression.decompress_prefix(data, codec, chunk_size=8)
+    assert prefix == TEXT.split('\n', 1)[0]
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def test_decompress_prefix_without_separator(codec):
+    data = compression.compress('single line', codec)
+    assert compression.decompress_prefix(data, codec) == 'single line'
+
+
+def test_invalid_codec():
+    with pytest.raises(ValueError):
+        compression.compress(TEXT, 'bzip')
+
+
+@pytest.mark.parametrize('codec', compression.CODECS)
+def test_decompress_head(codec):
+    data = compression.compress(TEXT, codec)
+    assert compression.decompress_head(data, codec, 100,
+                                       chunk_size=16) == TEXT[:100]
+    assert compression.decompress_head(data, codec, 10 ** 6) == TEXT
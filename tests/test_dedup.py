@@ -0,0 +1,28 @@
+from searcher import dedup
+
+
+PLOT = 'The Minister of Health is to be admitted for the removal of ' \
+       'varicose veins. When a vicar, Mr. Bridgenorth, also due to have ' \
+       'varicose veins removed, turns up slightly ahead of the minister, ' \
+       'he is mistaken for the illustrious patient.'
+
+
+def test_content_hash_is_stable():
+    assert dedup.content_hash(PLOT) == dedup.content_hash(PLOT)
+    assert dedup.content_hash(PLOT) != dedup.content_hash(PLOT + '!')
+    assert len(dedup.content_hash(PLOT)) == 32
+
+
+def test_minhash_similarity():
+    minhash = dedup.MinHash()
+    signature = minhash.signature(PLOT)
+    assert minhash.similarity(signature, minhash.signature(PLOT)) == 1.0
+    other = minhash.signature('Colt finds him and tells him to play.')
+    assert minhash.similarity(signature, other) < 0.2
+
+
+def test_near_duplicate_index_finds_similar_document():
+    index = dedup.NearDuplicateIndex(threshold=0.7)
+    assert index.find_or_add('first', PLOT) is None
+    assert index.find_or_add('second', PLOT + ' Also BY: don') == 'first'
+    assert index.find_or_add('third', 'Colt finds him and tells him.') is None
@@ -0,0 +1,35 @@
+from searcher.delta import DeltaIndex
+from searcher.document import GenericDocument
+
+
+def indexed(document_id, content):
+    document = GenericDocument(document_id, content)
+    document.indexer.index_document()
+    return document.indexer
+
+
+def test_find_by_word_orders_by_rank():
+    delta = DeltaIndex()
+    delta.register_document_indexes(indexed(1, 'vampire hunter in town'))
+    delta.register_document_indexes(indexed(2, 'vampire vampire'))
+    assert delta.find_by_word('vampire') == [(2, 1.0), (1, 0.25)]
+    assert delta.find_by_word('vampire', limit=1) == [(2, 1.0)]
+    assert delta.find_by_word('missing') == []
+
+
+def test_find_by_word_bounded_and_ranks():
+    delta = DeltaIndex()
+    delta.register_document_indexes(indexed(1, 'vampire hunter in town'))
+    delta.register_document_indexes(indexed(2, 'vampire vampire'))
+    assert delta.find_by_word('vampire', max_rank=0.5) == [(1, 0.25)]
+    assert delta.find_ranks('vampire', {2, 3}) == {2: 1.0}
+
+
+def test_iterate_and_clear():
+    delta = DeltaIndex()
+    delta.register_document_indexes(indexed(1, 'one two'))
+    assert len(delta) == 2
+    assert sorted(delta) == [(1, 'one', 0.5), (1, 'two', 0.5)]
+    delta.clear()
+    assert len(delta) == 0
+    assert list(delta) == []
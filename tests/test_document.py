@@ -0,0 +1,31 @@
+from searcher import compression
+from searcher.document import GenericDocument
+
+
+TEXT = 'Out of the Way (2006/I)\n  PL: Arthur Berkeley has a secret'
+
+
+def test_document_content_decompressed():
+    data = compression.compress(TEXT, 'zlib')
+    document = GenericDocument(1, data, 'zlib')
+    assert document.content == TEXT
+
+
+def test_document_preview_does_not_decode_content():
+    data = compression.compress(TEXT, 'lzma')
+    document = GenericDocument(1, data, 'lzma')
+    assert document.preview == 'Out of the Way (2006/I)'
+    assert document._GenericDocument__content is None
+
+
+def test_document_words_of_compressed_content():
+    plain = GenericDocument(1, TEXT)
+    compressed = GenericDocument(1, compression.compress(TEXT, 'zlib'), 'zlib')
+    assert list(plain) == list(compressed)
+
+
+def test_document_head_of_compressed_content():
+    document = GenericDocument(1, compression.compress(TEXT, 'zlib'), 'zlib')
+    assert document.head(13) == 'Out of the Wa'
+    assert document._GenericDocument__content is None
+    assert GenericDocument(1, TEXT).head(3) == 'Out'
@@ -0,0 +1,69 @@
+from searcher import fuzzy
+
+
+VOCABULARY = ['vampir', 'vampire', 'vamp', 'minister', 'monster', 'minist',
+              'sinister', 'van']
+
+
+def test_trigrams():
+    assert fuzzy.trigrams('cat') == {'$ca', 'cat', 'at$'}
+
+
+def test_edit_distance():
+    assert fuzzy.edit_distance('minister', 'minister', 2) == 0
+    assert fuzzy.edit_distance('minster', 'minister', 2) == 1
+    assert fuzzy.edit_distance('monster', 'minister', 2) == 2
+    assert fuzzy.edit_distance('van', 'vampire', 2) == 3
+
+
+def test_search_within_distance():
+    index = fuzzy.TrigramIndex.build(VOCABULARY)
+    assert index.search('minster', 1) == [('minister', 1), ('monster', 1)]
+    assert ('sinister', 2) in index.search('minster', 2)
+    assert index.search('xylophone', 2) == []
+
+
+def test_candidates_do_not_scan_vocabulary():
+    index = fuzzy.TrigramIndex.build(VOCABULARY)
+    assert 'van' not in index.candidates('minister', 1)
+
+
+def test_serialization_roundtrip():
+    index = fuzzy.TrigramIndex.build(VOCABULARY)
+    restored = fuzzy.TrigramIndex.from_bytes(index.to_bytes())
+    assert restored.terms == index.terms
+    assert restored.postings == index.postings
+    assert len(fuzzy.TrigramIndex.from_bytes(
+        fuzzy.TrigramIndex().to_bytes())) == 0
+
+
+def test_add_matches_build():
+    index = fuzzy.TrigramIndex.build(VOCABULARY[:4])
+    index.add(VOCABULARY[4:])
+    built = fuzzy.TrigramIndex.build(VOCABULARY)
+    assert index.terms == built.terms
+    assert index.postings == built.postings
+
+
+def test_pattern_trigrams():
+    assert fuzzy.pattern_trigrams('*ra') == {'ra$'}
+    assert fuzzy.pattern_trigrams('*nist*') == {'nis', 'ist'}
+    assert fuzzy.pattern_trigrams('*a*') == set()
+
+
+def test_match_leading_wildcard():
+    index = fuzzy.TrigramIndex.build(VOCABULARY)
+    assert index.match('*nister') == ['minister', 'sinister']
+    assert index.match('*mpi?e') == ['vampire']
+    assert index.match('*xyz') == []
+    assert index.match('*a') is None
+
+
+def test_search_short_words():
+    index = fuzzy.TrigramIndex.build(['cat', 'cot', 'dog', 'ab', 'at',
+                                      'a', 'cattle'])
+    assert index.search('ct', 1) == [('at', 1), ('cat', 1), ('cot', 1)]
+    assert index.search('dg', 1) == [('dog', 1)]
+    assert index.search('ac', 1) == [('a', 1), ('ab', 1), ('at', 1)]
+    index.add(['act'])
+    assert ('act', 1) in index.search('ac', 1)
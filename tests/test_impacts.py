@@ -0,0 +1,67 @@
+import pytest
+from searcher.impacts import ImpactQuantizer, accumulate_impacts
+
+
+def test_quantize_scales_ranks():
+    quantizer = ImpactQuantizer(8)
+    assert quantizer.quantize(1.0) == 255
+    assert quantizer.quantize(0.5) == 128
+    assert quantizer.quantize(0.0001) == 1
+    assert abs(quantizer.dequantize(128) - 0.5) <= 0.5 / 255
+
+
+def test_quantize_is_monotonic():
+    quantizer = ImpactQuantizer(16)
+    ranks = [i / 1000 for i in range(1, 1001)]
+    impacts = list(map(quantizer.quantize, ranks))
+    assert impacts == sorted(impacts)
+    assert len(set(impacts)) == len(ranks)
+
+
+def test_invalid_bits():
+    with pytest.raises(ValueError):
+        ImpactQuantizer(12)
+
+
+def test_quantizer_converts_postings():
+    quantizer = ImpactQuantizer(8)
+    postings = [(1, 'vampir', 0.5), (1, 'count', 0.25)]
+    assert list(quantizer(postings)) == [(1, 'vampir', 128),
+                                         (1, 'count', 64)]
+
+
+def test_accumulate_dense_and_sparse_ids_agree():
+    parts = [('vampir', 1.0), ('count', 1.0)]
+    dense = {'vampir': [(3, 10), (1, 4)], 'count': [(1, 9), (2, 1)]}
+    sparse = {word: [(str(doc_id), impact) for doc_id, impact in hits]
+              for word, hits in dense.items()}
+    assert accumulate_impacts(parts, dense, 2) == [(1, 13), (3, 10)]
+    assert accumulate_impacts(parts, sparse, 2) == [('1', 13), ('3', 10)]
+    assert accumulate_impacts(parts, {'vampir': [], 'count': []}, 2) == []
+
+
+def test_accumulate_skips_documents():
+    parts = [('vampir', 1.0), ('count', 1.0)]
+    postings = {'vampir': [(3, 10), (1, 4)], 'count': [(1, 9), (2, 1)]}
+    assert accumulate_impacts(parts, postings, 1, {1}) == [(3, 10)]
+    sparse = {word: [(str(doc_id), impact) for doc_id, impact in hits]
+              for word, hits in postings.items()}
+    assert accumulate_impacts(parts, sparse, 1, {'1'}) == [('3', 10)]
+
+
+def test_quantized_ranking_matches_float_ranking():
+    quantizer = ImpactQuantizer(16)
+    documents = {doc_id: {'vampir': (doc_id % 7 + 1) / 50,
+                          'count': (doc_id % 5 + 1) / 40}
+                 for doc_id in range(1, 200)}
+    floats = {doc_id: sum(ranks.values())
+              for doc_id, ranks in documents.items()}
+    parts = [('vampir', 1.0), ('count', 1.0)]
+    postings = {word: [(doc_id, quantizer.quantize(ranks[word]))
+                       for doc_id, ranks in documents.items()]
+                for word, _ in parts}
+    quantized = dict(accumulate_impacts(parts, postings, None))
+    for a in floats:
+        for b in floats:
+            if floats[a] - floats[b] > 2 / quantizer.scale:
+                assert quantized[a] > quantized[b]
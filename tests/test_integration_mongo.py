@@ -2,8 +2,10 @@ import os
 import pytest
 import pymongo
 import configparser
+from bson.objectid import ObjectId
 from operator import itemgetter
 from searcher.mongo import MongoController
+from searcher.deadline import Deadline
 
 
 @pytest.fixture(scope='module')
@@ -126,3 +128,106 @@ def test_query(controller_idx, db, capsys):
     doc_ids_string, _ = capsys.readouterr()
     doc_ids = doc_ids_string.strip().split()
     assert len(doc_ids) > 0
+
+
+def test_find_by_words_in_lookup(controller_idx, db):
+    words = [index['word'] for index in db.indexes.find().limit(5)]
+    postings = controller_idx.index_store.find_by_words(words + ['xyzzy'], 10)
+    assert postings['xyzzy'] == []
+    for word in words:
+        single = list(controller_idx.index_store.find_by_word(word, 10))
+        assert postings[word] == single
+
+
+def test_fetch_postings_in_lookup_deadline(controller_idx, db):
+    words = [index['_id'] for index in db.indexes.find().limit(5)]
+    controller_idx.term_lookup = 'in'
+    assert controller_idx.fetch_postings(words, 10, Deadline(0)) == {}
+    postings = controller_idx.fetch_postings(words, 10, Deadline(10000))
+    assert set(postings) == set(words)
+
+
+def test_iter_documents_batches(controller_docs, document_root):
+    batches = list(controller_docs.document_store.iter_documents(2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    for document_id, content in (doc for batch in batches for doc in batch):
+        document = controller_docs.document_store.load_document(document_id)
+        assert content == document.content
+
+
+def test_merge_delta_into_index_store(controller_init, document_root, db,
+                                      capsys):
+    controller_init.register(root=document_root, realtime=True)
+    merged = controller_init.merge_delta()
+    assert merged > 0
+    assert len(controller_init.delta) == 0
+    capsys.readouterr()
+    controller_init.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+
+
+def test_delete_hides_realtime_document(controller_init, document_root, db,
+                                        capsys):
+    controller_init.register(root=document_root, realtime=True)
+    results = controller_init.search('minister')
+    assert all(isinstance(doc_id, str) for doc_id, _ in results)
+    controller_init.delete([doc_id for doc_id, _ in results])
+    assert controller_init.search('minister') == []
+    controller_init.merge_delta()
+    assert all(isinstance(h['document'], ObjectId)
+               for index in db.indexes.find() for h in index['hits'])
+
+
+def test_query_prefix(controller_idx, capsys):
+    controller_idx.query('minist*', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+
+
+def test_delete_and_purge(controller_idx, db, capsys):
+    controller_idx.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    controller_idx.delete(doc_ids.split())
+    capsys.readouterr()
+    controller_idx.query('minister', measure=False, preview=False)
+    assert capsys.readouterr()[0].split() == []
+    assert controller_idx.purge() == 1
+    document_id = ObjectId(doc_ids.strip())
+    assert db.indexes.find({'hits.document': document_id}).count() == 0
+    assert db.tombstones.find().count() == 0
+
+
+def test_search_page_walks_all_results(controller_idx):
+    query = 'his the minister'
+    everything, cursor = controller_idx.search_page(query, limit=100)
+    assert cursor is None
+    pages, cursor = [], None
+    while True:
+        page, cursor = controller_idx.search_page(query, cursor, limit=1)
+        pages.extend(page)
+        if cursor is None:
+            break
+    assert pages == everything
+
+
+def test_query_snippets(controller_idx, capsys):
+    controller_idx.query('vicar', snippets=True)
+    title, snippet = capsys.readouterr()[0].splitlines()
+    assert 'Doctor in Charge' in title
+    assert '**vicar**' in snippet
+
+
+def test_search_filters(controller_idx):
+    episodes = controller_idx.search('his the type:episode')
+    assert len(episodes) == 2
+    assert len(controller_idx.search('his the year:1970..1979')) == 1
+
+
+def test_export_import(controller_idx, db, tmpdir):
+    archive = str(tmpdir.join('index.archive'))
+    expected = [rank for _, rank in controller_idx.search('his the')]
+    controller_idx.export_archive(archive)
+    controller_idx.init('all', force=True)
+    assert controller_idx.import_archive(archive) == 3
+    assert [rank for _, rank in controller_idx.search('his the')] == expected
@@ -1,9 +1,14 @@
 import os
 import csv
+import json
+import time
 import pytest
 import sqlite3
 import configparser
+from searcher import compression
 from searcher.sqlite import SQLiteController
+from searcher.deadline import Deadline, DeadlineExceeded
+from searcher.utils import stem_word
 
 
 def csv_import(csv_path, dbpath):
@@ -153,3 +158,708 @@ def test_query(config, controller_idx, capsys):
     doc_ids_string, _ = capsys.readouterr()
     doc_ids = doc_ids_string.strip().split()
     assert len(doc_ids) > 0
+
+
+def test_fetch_postings_concurrent(config, controller_idx):
+    conn = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    result = conn.execute('SELECT DISTINCT word FROM indexes LIMIT 5')
+    words = [r[0] for r in result.fetchall()]
+    postings = controller_idx.fetch_postings(words + words[:1], limit=10)
+    assert list(postings) == words
+    for word in words:
+        serial = list(controller_idx.index_store.find_by_word(word, 10))
+        assert postings[word] == serial
+
+
+def test_query_serial_matches_concurrent(config, controller_idx, capsys):
+    conn = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    result = conn.execute('SELECT DISTINCT word FROM indexes LIMIT 5')
+    query = ' '.join(r[0] for r in result.fetchall())
+    controller_idx.query(query, measure=False, preview=False)
+    concurrent, _ = capsys.readouterr()
+    controller_idx.query_workers = 1
+    controller_idx.query(query, measure=False, preview=False)
+    serial, _ = capsys.readouterr()
+    assert concurrent == serial
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def test_document_compressed_show_content(config, document_root, codec,
+                                          capsys):
+    config['sqlite3']['compression'] = codec
+    try:
+        controller = SQLiteController(config)
+        controller.init('all', force=True)
+        controller.register(root=document_root)
+    finally:
+        config.remove_option('sqlite3', 'compression')
+    capsys.readouterr()
+
+    conn = sqlite3.connect(config.get('sqlite3', 'documents'))
+    document = conn.execute('SELECT * FROM documents LIMIT 1').fetchall()[0]
+    assert document[2] == codec
+    controller.show(document_ids=[document[0]], preview=False)
+    content, _ = capsys.readouterr()
+    assert content[:-1] == compression.decompress(document[1], codec)
+
+
+def test_documents_table_migrated(config, controller):
+    docdb = sqlite3.connect(config.get('sqlite3', 'documents'))
+    docdb.execute('CREATE TABLE documents('
+                  'id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
+                  'content TEXT NOT NULL);')
+    docdb.execute('INSERT INTO documents (content) VALUES (?)',
+                  ('Dracula (1931)\n  PL: The vampire count', ))
+    docdb.commit()
+    docdb.close()
+    document = controller.document_store.load_document(1)
+    assert document.preview == 'Dracula (1931)'
+    assert document.content.endswith('The vampire count')
+    assert controller.document_store.find_hashes(['0' * 32]) == set()
+    assert controller.document_store.tombstones() == set()
+    controller.delete([1])
+    assert controller.document_store.tombstones() == {1}
+
+
+def test_store_documents_returns_ids(config, controller_docs):
+    controller_docs.delete([2])
+    contents = ['Alpha (2006)\n  PL: alpha', 'Beta (2007)\n  PL: beta']
+    ids = controller_docs.store_documents(contents, [None, None])
+    assert ids == [4, 5]
+    documents = controller_docs.document_store.load_documents(ids)
+    assert [document.content for document in documents] == contents
+
+
+def test_iter_documents_batches(config, controller_docs, document_root):
+    batches = list(controller_docs.document_store.iter_documents(2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    for document_id, content in (doc for batch in batches for doc in batch):
+        document = controller_docs.document_store.load_document(document_id)
+        assert content == document.content
+
+
+def test_register_realtime_searchable_before_merge(config, controller_init,
+                                                   document_root, capsys):
+    controller_init.register(root=document_root, realtime=True)
+    assert len(controller_init.delta) > 0
+    capsys.readouterr()
+    controller_init.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+
+
+def test_merge_delta_into_index_store(config, controller_init,
+                                      document_root, capsys):
+    controller_init.register(root=document_root, realtime=True)
+    merged = controller_init.merge_delta()
+    assert merged > 0
+    assert len(controller_init.delta) == 0
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    count = idxdb.execute('SELECT COUNT(*) FROM indexes').fetchone()[0]
+    assert count == merged
+    capsys.readouterr()
+    controller_init.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+
+
+def test_merge_delta_adds_new_terms_to_trigram_index(config, controller_init,
+                                                     tmpdir):
+    first, second = tmpdir.mkdir('first'), tmpdir.mkdir('second')
+    first.join('1').write('Dracula (1931)\n  PL: vampire count')
+    second.join('1').write('Nosferatu (1922)\n  PL: vampire ship')
+    controller_init.register(root=str(first), realtime=True)
+    controller_init.merge_delta()
+    controller_init.register(root=str(second), realtime=True)
+    controller_init.merge_delta()
+    terms = [term for term, _ in controller_init.term_dictionary]
+    assert sorted(controller_init.trigram_index.terms) == terms
+    assert SQLiteController(config).trigram_index.search('shup', 1) == \
+        [('ship', 1)]
+
+
+def test_document_register_skips_duplicates(config, controller_init,
+                                            document_root, tmpdir):
+    duplicates = tmpdir.mkdir('duplicates')
+    for name in os.listdir(document_root):
+        with open(os.path.join(document_root, name)) as fp:
+            content = fp.read()
+        duplicates.join(name).write(content)
+        duplicates.join(name + '-copy').write(content)
+    controller_init.register(root=document_root)
+    controller_init.register(root=str(duplicates))
+    assert controller_init.stats.counters['register.duplicates'] == 6
+    documents = len(os.listdir(document_root))
+    assert len(controller_init.document_store) == documents
+
+
+def test_query_prefix(config, controller_idx, capsys):
+    controller_idx.query('minist*', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+    assert controller_idx.stats.counters['query.expansions'] > 0
+
+
+def test_query_leading_wildcard(config, controller_idx, capsys):
+    controller_idx.query('*nister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+    with pytest.raises(ValueError):
+        controller_idx.search('*a*')
+
+
+def test_term_dictionary_built_at_index_time(config, controller_idx):
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    words = idxdb.execute('SELECT word, COUNT(*) FROM indexes GROUP BY word')
+    dictionary = controller_idx.term_dictionary
+    assert list(dictionary) == sorted(words.fetchall())
+
+
+def test_query_fuzzy(config, controller_idx, capsys):
+    controller_idx.query('vicr~', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+
+
+def test_query_fuzzy_fallback(config, controller_idx, capsys):
+    controller_idx.query('vicr', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert doc_ids.split() == []
+    controller_idx.fuzzy_fallback = True
+    controller_idx.query('vicr', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert len(doc_ids.split()) == 1
+
+
+def test_search_batch_matches_search(config, controller_idx):
+    queries = ['minister', 'football cousin', 'novel minister', 'missing']
+    batch = controller_idx.search_batch(queries)
+    assert batch == [controller_idx.search(query) for query in queries]
+
+
+def test_search_batch_fetches_each_term_once(config, controller_idx):
+    controller_idx.stats.reset()
+    controller_idx.search_batch(['minister colt', 'colt', 'minister'])
+    assert controller_idx.stats.counters['query.terms'] == 4
+    assert controller_idx.stats.counters['query.duplicate_terms'] == 2
+    controller_idx.search('colt minister colt', timeout_ms=10000)
+    assert controller_idx.stats.counters['query.duplicate_terms'] == 3
+
+
+def test_search_batch_fetches_whole_lists_only_for_filtered(config,
+                                                            controller_idx):
+    controller_idx.stats.reset()
+    queries = ['his', 'the type:episode']
+    results = controller_idx.search_batch(queries, limit=1)
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    whole = idxdb.execute('SELECT COUNT(*) FROM indexes '
+                          'WHERE word=?', (stem_word('the'), )).fetchone()[0]
+    assert whole > 1
+    assert controller_idx.stats.counters['query.postings'] == whole + 1
+    assert results == [controller_idx.search(query, limit=1)
+                       for query in queries]
+
+
+def test_search_batch_workers(config, controller_idx):
+    queries = ['minister', 'football cousin', 'novel minister', 'missing']
+    batch = controller_idx.search_batch(queries, workers=2)
+    assert batch == [controller_idx.search(query) for query in queries]
+
+
+def test_search_page_walks_all_results(config, controller_idx):
+    query = 'his the minister'
+    everything, cursor = controller_idx.search_page(query, limit=100)
+    assert cursor is None
+    assert [doc_id for doc_id, _ in everything] == \
+        [doc_id for doc_id, _ in controller_idx.search(query, limit=100)]
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = controller_idx.search_page(query, cursor, limit=1)
+        pages.extend(page)
+        if cursor is None:
+            break
+    assert pages == everything
+
+
+def test_search_page_finds_top_document_below_depth(config, controller_init,
+                                                    tmpdir):
+    documents = tmpdir.mkdir('documents')
+    documents.join('both').write('alpha beta')
+    documents.join('alpha').write(' '.join(['alpha'] * 6 + ['gamma'] * 4))
+    documents.join('beta').write(' '.join(['beta'] * 6 + ['delta'] * 4))
+    controller_init.register(root=str(documents), realtime=True)
+    controller_init.merge_delta()
+    everything = controller_init.search('alpha beta')
+    assert everything[0][1] == 1.0
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = controller_init.search_page('alpha beta', cursor,
+                                                   limit=1)
+        pages.extend(page)
+        if cursor is None:
+            break
+    assert pages[0] == everything[0]
+    assert sorted(pages) == sorted(everything)
+
+
+def test_query_paginate(config, controller_idx, capsys):
+    controller_idx.query('his the', paginate=True)
+    output = capsys.readouterr()[0]
+    assert 'next page' not in output
+    with pytest.raises(ValueError):
+        controller_idx.search_page('his the', cursor='garbage')
+
+
+def test_query_snippets(config, controller_idx, capsys):
+    controller_idx.query('vicar', snippets=True)
+    title, snippet = capsys.readouterr()[0].splitlines()
+    assert title.endswith('"Doctor in Charge" (1972) {The Minister\'s '
+                          'Health (#1.3)}')
+    assert '**vicar**' in snippet
+
+
+def test_load_documents_keeps_order(config, controller_docs):
+    ids = sorted(controller_docs.document_store, reverse=True)
+    documents = controller_docs.document_store.load_documents(ids + [999])
+    assert [document.document_id for document in documents] == ids
+
+
+def test_search_filters(config, controller_idx):
+    everything = controller_idx.search('his the')
+    assert len(everything) == 3
+    episodes = controller_idx.search('his the type:episode')
+    assert len(episodes) == 2
+    assert [hit for hit in everything if hit in episodes] == episodes
+    seventies = controller_idx.search('his the year:1970..1979 type:episode')
+    assert len(seventies) == 1
+    assert controller_idx.search('his the year:1990..') == \
+        [hit for hit in everything if hit not in episodes]
+    page, _ = controller_idx.search_page('his the year:1970..1979')
+    assert page == seventies
+    assert controller_idx.search_batch(['his the type:movie', 'his the']) \
+        == [controller_idx.search('his the type:movie'), everything]
+
+
+def test_metadata_rebuilt_when_missing(config, controller_idx):
+    expected = controller_idx.search('his the type:episode')
+    docdb = sqlite3.connect(config.get('sqlite3', 'documents'))
+    docdb.execute('DELETE FROM blobs')
+    docdb.commit()
+    controller = SQLiteController(config)
+    assert controller.search('his the type:episode') == expected
+    assert controller.document_store.load_blob('metadata')
+
+
+def test_metadata_kept_in_document_store(config, controller, document_root,
+                                         tmp_csv_buffer):
+    controller.init('documents')
+    controller.register(root=document_root)
+    controller.init('indexes')
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    tables = {row[0] for row in idxdb.execute(
+        'SELECT name FROM sqlite_master WHERE type=\'table\'')}
+    assert 'indexes' in tables
+    controller.index_store.csv_buffer = tmp_csv_buffer
+    controller.index()
+    csv_import(tmp_csv_buffer, config.get('sqlite3', 'indexes'))
+    assert controller.search('his the type:episode')
+
+    controller.init('indexes', force=True)
+    assert controller.document_store.load_blob('metadata')
+
+
+def test_force_init_documents_clears_metadata(config, controller_init,
+                                              tmpdir):
+    episodes = tmpdir.mkdir('episodes')
+    episodes.join('1').write('"Alpha" (1972) {Beta (#1.1)}\n  PL: alpha')
+    controller_init.register(root=str(episodes), realtime=True)
+    assert [doc_id for doc_id, _ in
+            controller_init.search('alpha type:episode')] == [1]
+
+    controller_init.init('documents', force=True)
+    movies = tmpdir.mkdir('movies')
+    movies.join('1').write('Alpha (2006)\n  PL: alpha')
+    controller_init.register(root=str(movies), realtime=True)
+    assert controller_init.search('alpha type:episode') == []
+    assert len(controller_init.search('alpha type:movie')) == 1
+
+
+def test_export_import(config, controller_idx, tmpdir, capsys):
+    archive = str(tmpdir.join('index.archive'))
+    queries = ['minister', 'his the', 'his the type:episode', 'vic*']
+    expected = [controller_idx.search(query) for query in queries]
+    controller_idx.export_archive(archive)
+
+    target = configparser.ConfigParser()
+    target.read_dict(config)
+    target['sqlite3']['documents'] = str(tmpdir.join('doc.db'))
+    target['sqlite3']['indexes'] = str(tmpdir.join('idx.db'))
+    controller = SQLiteController(target)
+    controller.init('all', force=True)
+    assert controller.import_archive(archive) == 3
+    assert 'imported 3 documents' in capsys.readouterr()[0]
+    assert [controller.search(query) for query in queries] == expected
+    assert len(controller.term_dictionary) == \
+        len(controller_idx.term_dictionary)
+
+
+def test_search_deadline_not_reached(config, controller_idx):
+    expected = controller_idx.search('his the minister')
+    results = controller_idx.search('his the minister', timeout_ms=10000)
+    assert not expected.partial and not results.partial
+    assert [doc_id for doc_id, _ in results] == \
+        [doc_id for doc_id, _ in expected]
+
+
+def test_search_deadline_slow_fetch(config, controller_idx, capsys):
+    find_by_word = controller_idx.index_store.find_by_word
+
+    def slow_find_by_word(word, limit=None, max_rank=None, deadline=None):
+        if word == stem_word('minister'):
+            time.sleep(0.1)
+        return find_by_word(word, limit, max_rank, deadline)
+
+    controller_idx.index_store.find_by_word = slow_find_by_word
+    results = controller_idx.search('his minister', timeout_ms=50)
+    assert results.partial
+    assert set(results) == set(controller_idx.search('his'))
+    controller_idx.query('his minister', timeout_ms=50)
+    assert 'partial results' in capsys.readouterr()[0]
+
+
+def test_find_by_word_interrupted_at_deadline(config, controller_idx):
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    idxdb.executemany('INSERT INTO indexes (document_id, word, rank) '
+                      'VALUES (?, ?, ?)',
+                      ((doc_id, 'vampir', 1 / doc_id)
+                       for doc_id in range(1, 20000)))
+    idxdb.commit()
+    index_store = controller_idx.index_store
+    with pytest.raises(DeadlineExceeded):
+        list(index_store.find_by_word('vampir', deadline=Deadline(0)))
+    assert len(list(index_store.find_by_word('vampir',
+                                             deadline=Deadline(10000)))) \
+        == 19999
+    assert controller_idx.fetch_postings(['vampir', 'his'],
+                                         deadline=Deadline(0)) == {}
+
+
+def test_search_filtered_deadline_stops_ranking(config, controller_init):
+    contents = ['"Alpha" (1972) {{Beta (#1.{})}}\n  PL: alpha'.format(number)
+                for number in range(2500)]
+    controller_init.store_documents(contents, [None] * len(contents), True)
+    controller_init.merge_delta()
+    filter_postings = controller_init.filter_postings
+
+    def slow_filter_postings(postings, allowed):
+        time.sleep(0.1)
+        return filter_postings(postings, allowed)
+
+    controller_init.filter_postings = slow_filter_postings
+    results = controller_init.search('alpha type:episode', timeout_ms=50)
+    assert results.partial
+    assert len(results) == 10
+
+
+def test_rank_until_expired_deadline(config, controller_idx):
+    query_parts = controller_idx.parse_query('his the')
+    postings = controller_idx.fetch_postings([w for w, _ in query_parts])
+    results = controller_idx.rank_until(query_parts, postings, 10,
+                                        Deadline(0), chunk_size=1)
+    assert results.partial
+    best = {hits[0][0] for hits in postings.values()}
+    assert {doc_id for doc_id, _ in results} == best
+
+
+@pytest.mark.parametrize('by', ['title', 'terms'])
+def test_reorder(config, controller_idx, tmpdir, capsys, by):
+    queries = ['minister', 'his the', 'his the type:episode', 'vic*']
+
+    def results():
+        return [[(controller_idx.document_store.load_document(doc_id).preview,
+                  rank) for doc_id, rank in controller_idx.search(query)]
+                for query in queries]
+
+    expected = results()
+    archive = str(tmpdir.join('reorder.archive'))
+    report = controller_idx.reorder(by, archive, sample_size=5)
+    assert 'posting id gaps' in capsys.readouterr()[0]
+    assert not os.path.exists(archive)
+    assert report['after']['postings'] == report['before']['postings']
+    assert results() == expected
+    if by == 'title':
+        previews = [controller_idx.document_store.load_document(doc_id)
+                    .preview for doc_id in (1, 2, 3)]
+        assert previews[0].startswith('"Doctor in Charge"')
+        assert previews[1].startswith('Out of the Way')
+
+
+def test_query_batch_jsonl(config, controller_idx, tmpdir, capsys):
+    batch = tmpdir.join('queries.jsonl')
+    batch.write('{"id": "q1", "query": "minister"}\n'
+                '{"id": "q2", "query": "missing"}\n')
+    controller_idx.query_batch(str(batch))
+    lines, _ = capsys.readouterr()
+    results = [json.loads(line) for line in lines.splitlines()]
+    assert [r['id'] for r in results] == ['q1', 'q2']
+    assert len(results[0]['results']) == 1
+    assert results[1]['results'] == []
+
+
+def test_query_batch_reports_invalid_queries(config, controller_idx, tmpdir,
+                                             capsys):
+    batch = tmpdir.join('queries.jsonl')
+    batch.write('{"id": "q1", "query": "year:19x0 minister"}\n'
+                '{"id": "q2", "query": "*"}\n'
+                'not json\n'
+                '{"id": "q4", "query": "minister"}\n')
+    controller_idx.query_batch(str(batch))
+    lines, _ = capsys.readouterr()
+    results = [json.loads(line) for line in lines.splitlines()]
+    assert [r['id'] for r in results] == ['q1', 'q2', 3, 'q4']
+    assert all('error' in r for r in results[:3])
+    assert len(results[3]['results']) == 1
+
+
+def test_delete_hides_document_from_query(config, controller_idx, capsys):
+    controller_idx.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    deleted = controller_idx.delete(doc_ids.split())
+    assert deleted == [int(doc_ids)]
+    assert len(controller_idx.document_store) == 2
+    capsys.readouterr()
+    controller_idx.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    assert doc_ids.split() == []
+
+
+def test_delete_keeps_limit_filled(config, controller_init, tmpdir):
+    documents = tmpdir.mkdir('documents')
+    for count in range(1, 5):
+        documents.join(str(count)).write(
+            ' '.join(['vampire'] * count + ['count'] * (5 - count)))
+    controller_init.register(root=str(documents), realtime=True)
+    controller_init.merge_delta()
+    top, second, third, last = controller_init.search('vampire', limit=4)
+    controller_init.delete([last[0]])
+    controller_init.stats.reset()
+    assert controller_init.search('vampire', limit=1) == [top]
+    assert controller_init.stats.counters['query.postings'] == 1
+
+    controller_init.delete([top[0]])
+    assert controller_init.search('vampire', limit=1) == [second]
+    assert controller_init.search_batch(['vampire'], limit=1) == [[second]]
+    assert controller_init.search_batch(['vampire', 'vampire type:movie'],
+                                        limit=1)[0] == [second]
+
+
+def test_purge_removes_indexes(config, controller_idx, capsys):
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    before = idxdb.execute('SELECT COUNT(*) FROM indexes').fetchone()[0]
+    controller_idx.delete(['1'])
+    assert controller_idx.purge() == 1
+    after = idxdb.execute('SELECT COUNT(*) FROM indexes').fetchone()[0]
+    deleted = idxdb.execute('SELECT COUNT(*) FROM indexes '
+                            'WHERE document_id=1').fetchone()[0]
+    assert 0 < after < before
+    assert deleted == 0
+    assert controller_idx.document_store.tombstones() == set()
+
+
+def test_update_replaces_document(config, controller_idx, tmpdir, capsys):
+    controller_idx.query('minister', measure=False, preview=False)
+    doc_ids, _ = capsys.readouterr()
+    new_plot = tmpdir.join('plot')
+    new_plot.write('Dracula (1931)\n  PL: The vampire count moves to London')
+    new_ids = controller_idx.update(doc_ids.strip(), str(new_plot))
+    capsys.readouterr()
+    controller_idx.query('minister', measure=False, preview=False)
+    assert capsys.readouterr()[0].split() == []
+    controller_idx.query('vampire', measure=False, preview=False)
+    assert capsys.readouterr()[0].split() == [str(new_ids[0])]
+
+
+def test_update_with_stored_content_keeps_document(config, controller_idx,
+                                                   tmpdir, document_root,
+                                                   capsys):
+    controller_idx.deduplicate = True
+    controller_idx.query('minister', measure=False, preview=False)
+    doc_id = capsys.readouterr()[0].strip()
+    other = next(document for document
+                 in controller_idx.document_store.load_documents(
+                     list(controller_idx.document_store))
+                 if str(document.document_id) != doc_id)
+    duplicate = tmpdir.join('plot')
+    duplicate.write(other.content)
+    assert controller_idx.update(doc_id, str(duplicate)) == []
+    assert 'not updated' in capsys.readouterr()[0]
+    controller_idx.query('minister', measure=False, preview=False)
+    assert capsys.readouterr()[0].split() == [doc_id]
+
+
+def test_prune_top_n(config, controller_idx, capsys):
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    words = idxdb.execute('SELECT COUNT(DISTINCT word) FROM indexes')
+    words = words.fetchone()[0]
+    report = controller_idx.prune(top_n=1, sample_size=20)
+    assert report['postings_after'] == words
+    assert report['postings_before'] > words
+    assert 0 < report['recall'] <= 1
+    count = idxdb.execute('SELECT COUNT(*) FROM indexes').fetchone()[0]
+    assert count == words
+
+
+def test_prune_keeping_query_limit_keeps_recall(config, controller_idx):
+    report = controller_idx.prune(top_n=10, sample_size=20)
+    assert report['recall'] == 1.0
+
+
+def test_prune_recall_against_full_ranking(config, controller_init,
+                                           tmpdir):
+    documents = tmpdir.mkdir('documents')
+    documents.join('both').write('alpha beta')
+    documents.join('alpha').write(' '.join(['alpha'] * 6 + ['gamma'] * 4))
+    documents.join('beta').write(' '.join(['beta'] * 6 + ['delta'] * 4))
+    controller_init.register(root=str(documents), realtime=True)
+    controller_init.merge_delta()
+    assert controller_init.term_dictionary.frequency('alpha') == 2
+    config['default']['query_limit'] = '1'
+    try:
+        report = controller_init.prune(top_n=1, sample_size=20)
+    finally:
+        config['default']['query_limit'] = '10'
+    assert report['recall'] < 1
+    assert controller_init.term_dictionary.frequency('alpha') == 1
+
+
+def test_prune_threshold(config, controller_idx):
+    report = controller_idx.prune(threshold=0.02, sample_size=20)
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    lowest = idxdb.execute('SELECT MIN(rank) FROM indexes').fetchone()[0]
+    assert lowest >= 0.02
+    assert report['postings_after'] < report['postings_before']
+
+
+def test_quantized_index(config, controller_docs, tmp_csv_buffer):
+    controller_docs.index_store.csv_buffer = tmp_csv_buffer
+    controller_docs.index()
+    csv_import(tmp_csv_buffer, config.get('sqlite3', 'indexes'))
+    queries = ['minister', 'football player cousin', 'his the']
+    float_results = [[doc_id for doc_id, _ in controller_docs.search(query)]
+                     for query in queries]
+
+    config['default']['quantization'] = '16'
+    try:
+        controller = SQLiteController(config)
+        controller.init('indexes', force=True)
+        controller.index_store.csv_buffer = tmp_csv_buffer
+        controller.index()
+    finally:
+        config.remove_option('default', 'quantization')
+    csv_import(tmp_csv_buffer, config.get('sqlite3', 'indexes'))
+
+    assert SQLiteController(config).impact_bits == 16
+    for query, expected in zip(queries, float_results):
+        results = controller.search(query)
+        assert all(isinstance(rank, int) for _, rank in results)
+        assert [doc_id for doc_id, _ in results] == expected
+
+
+def test_quantized_index_needs_integer_ranks(config, controller_docs,
+                                             tmp_csv_buffer):
+    config['default']['quantization'] = '8'
+    try:
+        controller = SQLiteController(config)
+        controller.index_store.csv_buffer = tmp_csv_buffer
+        with pytest.raises(ValueError):
+            controller.index()
+    finally:
+        config.remove_option('default', 'quantization')
+    assert SQLiteController(config).impact_bits == 0
+
+
+def test_quantized_prune_threshold(config, controller_docs, tmp_csv_buffer):
+    config['default']['quantization'] = '8'
+    try:
+        controller = SQLiteController(config)
+        controller.init('indexes', force=True)
+        controller.index_store.csv_buffer = tmp_csv_buffer
+        controller.index()
+    finally:
+        config.remove_option('default', 'quantization')
+    csv_import(tmp_csv_buffer, config.get('sqlite3', 'indexes'))
+    report = controller.prune(threshold=0.02, sample_size=20)
+    idxdb = sqlite3.connect(config.get('sqlite3', 'indexes'))
+    lowest = idxdb.execute('SELECT MIN(rank) FROM indexes').fetchone()[0]
+    assert lowest == round(0.02 * 255)
+    assert report['postings_after'] < report['postings_before']
+
+
+def test_index_resume(config, controller_docs, tmp_csv_buffer):
+    controller_docs.index_store.csv_buffer = tmp_csv_buffer
+    controller_docs.index()
+    with open(tmp_csv_buffer) as fp:
+        expected = fp.read()
+    expected_terms = dict(controller_docs.term_dictionary)
+
+    controller = SQLiteController(config)
+    controller.checkpoint_interval = 1
+    controller.index_store.csv_buffer = tmp_csv_buffer
+    controller.index_store.max_query_length = 5
+    register = controller.index_store.register_document_indexes
+    indexed = []
+
+    def crashing_register(index_document):
+        register(index_document)
+        indexed.append(True)
+        if len(indexed) == 3:
+            raise RuntimeError('crash')
+
+    controller.index_store.register_document_indexes = crashing_register
+    with pytest.raises(RuntimeError):
+        controller.index()
+
+    controller = SQLiteController(config)
+    controller.index_store.csv_buffer = tmp_csv_buffer
+    controller.index(resume=True)
+    with open(tmp_csv_buffer) as fp:
+        assert fp.read() == expected
+    assert dict(controller.term_dictionary) == expected_terms
+    assert controller.load_checkpoint()[0] is None
+
+
+def test_index_resume_refuses_truncated_buffer(config, controller_docs,
+                                               tmp_csv_buffer):
+    controller_docs.checkpoint_interval = 1
+    controller_docs.index_store.csv_buffer = tmp_csv_buffer
+    controller_docs.index_store.max_query_length = 5
+    register = controller_docs.index_store.register_document_indexes
+    indexed = []
+
+    def crashing_register(index_document):
+        register(index_document)
+        indexed.append(True)
+        if len(indexed) == 3:
+            raise RuntimeError('crash')
+
+    controller_docs.index_store.register_document_indexes = crashing_register
+    with pytest.raises(RuntimeError):
+        controller_docs.index()
+    checkpoint = controller_docs.load_checkpoint()[0]
+    assert checkpoint['csv_size'] > 0
+
+    with open(tmp_csv_buffer, 'r+') as fp:
+        fp.truncate(checkpoint['csv_size'] - 1)
+    controller = SQLiteController(config)
+    controller.index_store.csv_buffer = tmp_csv_buffer
+    with pytest.raises(ValueError):
+        controller.index(resume=True)
+    with open(tmp_csv_buffer, 'rb') as fp:
+        assert b'\0' not in fp.read()
+
+    os.remove(tmp_csv_buffer)
+    with pytest.raises(ValueError):
+        controller.index(resume=True)
+    assert not os.path.isfile(tmp_csv_buffer)
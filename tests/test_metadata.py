@@ -0,0 +1,66 @@
+import pytest
+from searcher.metadata import parse_title, parse_filter, Bitmap, \
+    MetadataIndex
+
+
+def test_parse_title_episode():
+    line = '"Doctor in Charge" (1972) {The Minister\'s Health (#1.3)}'
+    assert parse_title(line) == {'title': 'Doctor in Charge', 'year': 1972,
+                                 'type': 'episode'}
+
+
+def test_parse_title_kinds():
+    assert parse_title('"The Fall Guy" (1981)')['type'] == 'series'
+    assert parse_title('Out of the Way (2006/I)') == \
+        {'title': 'Out of the Way', 'year': 2006, 'type': 'movie'}
+    assert parse_title('Some Show (1999) (TV)')['type'] == 'tv'
+    assert parse_title('Some Game (2001) (VG)')['type'] == 'game'
+    assert parse_title('Lost Film (????)')['year'] is None
+    assert parse_title('no title here') == \
+        {'title': 'no title here', 'year': None, 'type': None}
+
+
+def test_parse_filter():
+    field, predicate = parse_filter('year:1970..1979')
+    assert field == 'year'
+    assert predicate(1970) and predicate(1979) and not predicate(1980)
+    assert parse_filter('year:1972')[1](1972)
+    assert not parse_filter('year:1972')[1](1973)
+    assert parse_filter('year:..1950')[1](1900)
+    assert parse_filter('type:episode,movie')[1]('movie')
+    assert parse_filter('minister') is None
+    with pytest.raises(ValueError):
+        parse_filter('year:seventies')
+
+
+def test_bitmap_operations():
+    a, b = Bitmap(), Bitmap()
+    for ordinal in (1, 9, 100):
+        a.add(ordinal)
+    for ordinal in (9, 100, 2000):
+        b.add(ordinal)
+    assert 9 in a and 10 not in a and 5000 not in a
+    assert list(a & b) == [9, 100]
+    assert list(a | b) == [1, 9, 100, 2000]
+    assert len(a | b) == 4
+    assert list(Bitmap.from_bytes(b.to_bytes())) == [9, 100, 2000]
+
+
+def test_metadata_index_select_and_roundtrip():
+    index = MetadataIndex()
+    index.add('a', {'year': 1972, 'type': 'episode'})
+    index.add('b', {'year': 1981, 'type': 'episode'})
+    index.add('c', {'year': 2006, 'type': 'movie'})
+    index = MetadataIndex.from_bytes(index.to_bytes())
+    selected = index.select([parse_filter('type:episode'),
+                             parse_filter('year:1970..1979')])
+    assert [document for document in 'abc'
+            if index.allows(selected, document)] == ['a']
+    assert not index.allows(selected, 'unknown')
+
+
+def test_metadata_index_integer_ids():
+    index = MetadataIndex()
+    index.add(7, {'year': 1972, 'type': 'movie'})
+    assert index.document_ids == []
+    assert index.allows(index.select([parse_filter('type:movie')]), 7)
@@ -0,0 +1,28 @@
+import pytest
+from searcher.reorder import document_order, posting_gap_bytes
+
+
+DOCUMENTS = [
+    (1, '"The Fall Guy" (1982) {Happy Trails (#2.1)}\n  vampire hunter'),
+    (2, 'Out of the Way (2006/I)\n  guitar player in town'),
+    (3, '"The Fall Guy" (1981) {Win One for the Gipper (#1.1)}\n  vampire'),
+    (4, '"Doctor in Charge" (1972)\n  minister vicar'),
+]
+
+
+def test_order_by_title():
+    assert document_order(DOCUMENTS, 'title') == [4, 2, 3, 1]
+
+
+def test_order_by_terms_is_permutation():
+    order = document_order(DOCUMENTS, 'terms')
+    assert sorted(order) == [1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        document_order(DOCUMENTS, 'size')
+
+
+def test_posting_gap_bytes():
+    postings = [('near', [(1, 0.5), (2, 0.1)]),
+                ('far', [(1, 0.5), (3, 0.2), ('deleted', 0.1)])]
+    ordinals = {'1': 0, '2': 1, '3': 300}
+    assert posting_gap_bytes(postings, ordinals) == 1 + 1 + 1 + 2
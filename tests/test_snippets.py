@@ -0,0 +1,37 @@
+from searcher.snippets import make_snippet, best_window
+from searcher.utils import iterate_words
+
+
+TEXT = 'The Minister of Health is to be admitted for the removal of ' \
+       'varicose veins. When a vicar, Mr. Bridgenorth, also due to have ' \
+       'varicose veins removed, turns up slightly ahead of the minister, ' \
+       'he is mistaken for the illustrious patient.'
+
+
+def terms(query):
+    return set(iterate_words(query))
+
+
+def test_snippet_highlights_terms():
+    snippet = make_snippet(TEXT, terms('vicar'), length=6, context=2)
+    assert snippet == '... When a **vicar**, Mr. Bridgenorth, also ...'
+
+
+def test_snippet_prefers_window_with_more_terms():
+    snippet = make_snippet(TEXT, terms('minister mistaken'), length=8,
+                           context=1)
+    assert '**minister**' in snippet
+    assert '**mistaken**' in snippet
+    assert snippet.startswith('... the **minister**')
+
+
+def test_snippet_without_matches_starts_at_beginning():
+    snippet = make_snippet(TEXT, terms('dragon'), length=4)
+    assert snippet == 'The Minister of Health ...'
+    assert make_snippet('', terms('dragon')) == ''
+
+
+def test_best_window():
+    matches = [(1, 'a'), (10, 'a'), (12, 'b'), (30, 'a')]
+    assert best_window(matches, 5) == 10
+    assert best_window([], 5) == 0
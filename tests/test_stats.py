@@ -0,0 +1,47 @@
+from searcher.stats import Stats
+
+
+def test_timer_accumulates_time_and_calls():
+    stats = Stats()
+    for _ in range(3):
+        with stats.timer('index.load'):
+            pass
+    assert stats.calls['index.load'] == 3
+    assert stats.timers['index.load'] >= 0
+
+
+def test_timer_records_when_exception_raised():
+    stats = Stats()
+    try:
+        with stats.timer('index.load'):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert stats.calls['index.load'] == 1
+
+
+def test_as_dict_filters_by_prefix():
+    stats = Stats()
+    stats.incr('index.tokens', 10)
+    stats.incr('query.terms', 2)
+    with stats.timer('index.count'):
+        pass
+    result = stats.as_dict('index')
+    assert result['counters'] == {'index.tokens': 10}
+    assert list(result['timers']) == ['index.count']
+
+
+def test_report_lists_timers_and_counters():
+    stats = Stats()
+    stats.incr('register.documents', 3)
+    with stats.timer('register.read'):
+        pass
+    report = stats.report('register')
+    assert 'register.documents' in report
+    assert 'register.read' in report
+
+
+def test_timed_iter_times_each_item():
+    stats = Stats()
+    assert list(stats.timed_iter('index.load', [1, 2, 3])) == [1, 2, 3]
+    assert stats.calls['index.load'] == 4
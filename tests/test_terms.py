@@ -0,0 +1,59 @@
+import pytest
+from searcher.terms import TermDictionary, literal_prefix
+
+
+FREQUENCIES = {'vampir': 12, 'vamp': 3, 'vampireland': 1, 'van': 40,
+               'valley': 7, 'zebra': 2, 'apple': 5, 'vamoos': 4}
+
+
+def test_literal_prefix():
+    assert literal_prefix('vamp*') == 'vamp'
+    assert literal_prefix('v?mp*') == 'v'
+    assert literal_prefix('vamp') == 'vamp'
+
+
+def test_dictionary_iterates_sorted_terms():
+    dictionary = TermDictionary.build(FREQUENCIES, block_size=3)
+    assert list(dictionary) == sorted(FREQUENCIES.items())
+    assert len(dictionary) == len(FREQUENCIES)
+    assert len(dictionary.blocks) == 3
+
+
+def test_expand_prefix_ordered_by_frequency():
+    dictionary = TermDictionary.build(FREQUENCIES, block_size=3)
+    assert dictionary.expand('vamp*') == [('vampir', 12), ('vamp', 3),
+                                          ('vampireland', 1)]
+    assert dictionary.expand('x*') == []
+
+
+def test_expand_caps_expansions():
+    dictionary = TermDictionary.build(FREQUENCIES, block_size=3)
+    expansions = dictionary.expand('va*', max_expansions=2)
+    assert expansions == [('van', 40), ('vampir', 12)]
+
+
+def test_expand_wildcard():
+    dictionary = TermDictionary.build(FREQUENCIES, block_size=3)
+    assert dictionary.expand('va?p') == [('vamp', 3)]
+    with pytest.raises(ValueError):
+        dictionary.expand('*ra')
+
+
+def test_frequency():
+    dictionary = TermDictionary.build(FREQUENCIES, block_size=3)
+    assert dictionary.frequency('valley') == 7
+    assert dictionary.frequency('vampire') == 0
+
+
+def test_serialization_roundtrip():
+    dictionary = TermDictionary.build(FREQUENCIES, block_size=3)
+    restored = TermDictionary.from_bytes(dictionary.to_bytes())
+    assert list(restored) == list(dictionary)
+    assert restored.first_terms == dictionary.first_terms
+    assert len(restored) == len(dictionary)
+
+
+def test_merged_adds_frequencies():
+    dictionary = TermDictionary.build({'vamp': 3, 'van': 1})
+    merged = dictionary.merged({'van': 2, 'zebra': 1})
+    assert list(merged) == [('vamp', 3), ('van', 3), ('zebra', 1)]
@@ -72,3 +72,23 @@ def test_document_iterator_nested(tmpdir):
     assert os.path.join(str(nested_tmp), 'two') in paths
     assert os.path.join(str(nested_tmp), 'three') in paths
     assert len(paths) == 3
+
+
+def test_varint_roundtrip():
+    for value in [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63]:
+        data = utils.encode_varint(value)
+        assert utils.decode_varint(data) == (value, len(data))
+
+
+def test_varint_sequence():
+    data = b''.join(map(utils.encode_varint, [5, 1000, 0]))
+    first, position = utils.decode_varint(data)
+    second, position = utils.decode_varint(data, position)
+    third, position = utils.decode_varint(data, position)
+    assert (first, second, third) == (5, 1000, 0)
+    assert position == len(data)
+
+
+def test_varint_small_values_take_one_byte():
+    assert len(utils.encode_varint(127)) == 1
+    assert len(utils.encode_varint(128)) == 2